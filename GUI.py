@@ -1,59 +1,719 @@
 import sys
 from PySide6.QtWidgets import (QApplication, QMainWindow, QWidget, QVBoxLayout, 
                                QHBoxLayout, QLabel, QPushButton, QTextEdit, 
-                               QGroupBox, QScrollArea, QFrame)
-from PySide6.QtCore import Qt, QThread, Signal, QTimer
+                               QGroupBox, QScrollArea, QFrame, QCheckBox, QProgressBar)
+from PySide6.QtCore import Qt, QThread, Signal, QTimer, QObject, QThreadPool, QRunnable
 from PySide6.QtGui import QPixmap, QImage
 from PIL import Image
 import qrcode
+import engineio
 import socketio
 import uuid
 import base64
-import io
+import hashlib
 import os
+import random
+import shutil
+import socket
+import subprocess
+import threading
+import time
 from datetime import datetime
 
+# Relay server the desktop connects to and phones upload through.
+# Set RELAY_SERVER_URL to use another deployment, or RELAY_MODE=local to
+# run server.py on this computer so phones on the same network upload to
+# it directly (see LocalRelay).
+SERVER_URL = os.getenv('RELAY_SERVER_URL', 'https://web-img.onrender.com').rstrip('/')
+RELAY_MODE = os.getenv('RELAY_MODE', 'remote')
+LOCAL_RELAY_PORT = int(os.getenv('LOCAL_RELAY_PORT', 5000))
+
+class InOrderEngineIOClient(engineio.Client):
+    """Engine.IO client that hands messages to Socket.IO one at a time.
+    
+    The stock client starts a thread per message. Socket.IO reassembles a
+    binary event from several messages in shared state, so two binary
+    events back to back (photo chunks) could be interleaved and corrupted.
+    """
+    def _trigger_event(self, event, *args, **kwargs):
+        if event == 'message':
+            kwargs['run_async'] = False
+        return super()._trigger_event(event, *args, **kwargs)
+
+class InOrderClient(socketio.Client):
+    """Socket.IO client whose event handlers run in arrival order.
+    
+    Handlers run on the connection's read thread, so they must not block
+    (the photo handlers only queue work or append to a file).
+    """
+    def _engineio_client_class(self):
+        return InOrderEngineIOClient
+
+def lan_address():
+    """This computer's address on the local network (127.0.0.1 if there is none)"""
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+        try:
+            # No packet is sent; this only picks the interface with a route out
+            s.connect(('10.255.255.255', 1))
+            return s.getsockname()[0]
+        except OSError:
+            return '127.0.0.1'
+
+class LocalRelay:
+    """server.py running on this computer, for phones on the same network.
+    
+    The relay is a child process listening on all interfaces. The desktop
+    connects to it over loopback and the QR code points phones at the LAN
+    address, so photos never leave the local network. The debugger and
+    reloader are off (FLASK_DEBUG=0) since the port is reachable from
+    the LAN.
+    """
+    def __init__(self, port):
+        self.port = port
+        self.process = None
+        
+    def start(self):
+        server_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'server.py')
+        self.process = subprocess.Popen(
+            [sys.executable, server_path],
+            cwd=os.path.dirname(server_path),
+            env={**os.environ, 'PORT': str(self.port), 'FLASK_DEBUG': '0'}
+        )
+        
+    @property
+    def local_url(self):
+        return f"http://127.0.0.1:{self.port}"
+        
+    @property
+    def lan_url(self):
+        return f"http://{lan_address()}:{self.port}"
+        
+    def stop(self):
+        if self.process is None or self.process.poll() is not None:
+            return
+        self.process.terminate()
+        try:
+            self.process.wait(5)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+
+def backoff_delay(attempt, base, cap):
+    """Exponential backoff with jitter: half the delay is fixed, half random"""
+    delay = min(cap, base * 2 ** attempt)
+    return delay / 2 + random.uniform(0, delay / 2)
+
 class SocketIOThread(QThread):
-    """Thread to handle Socket.IO connection"""
+    """Thread that keeps the Socket.IO connection up.
+    
+    One client is reused for the life of the app. It connects over
+    WebSocket only (no polling first), and whenever the connection fails
+    or drops it is retried with jittered exponential backoff until the
+    app closes. The connect handler registers the desktop again.
+    """
+    HEARTBEAT_INTERVAL = 60  # seconds; keeps the session within the server's TTL
+    RECONNECT_DELAY = 1  # seconds before the first retry, doubled per attempt
+    RECONNECT_DELAY_MAX = 30
+    CONNECT_TIMEOUT = 10  # seconds to wait for the server to accept the connection
+    
     connected = Signal()
     disconnected = Signal()
-    photo_received = Signal(dict)
     connection_error = Signal(str)
+    reconnecting = Signal(int, float)  # attempt number, seconds until it starts
+    reconnected = Signal(float, int)  # seconds the connection was down, failed attempts
+    relay_progress = Signal(str, int, float)  # upload ID, bytes relayed by the server, link rate in bytes/s
     
-    def __init__(self, session_id):
+    def __init__(self, session_id, receiver, server_url=SERVER_URL):
         super().__init__()
         self.session_id = session_id
-        self.sio = socketio.Client()
+        self.receiver = receiver
+        self.server_url = server_url
+        self.upload_options = None  # e.g. {'max_dimension': 1920, 'quality': 0.85}
+        self.sio = InOrderClient(reconnection=False)  # reconnects are handled in run()
         self.should_run = True
+        self.stop_event = threading.Event()
+        self.wake = threading.Event()  # set on disconnect so run() reconnects at once
         self.setup_handlers()
         
+        # Confirmations are sent from the thread that saved the photo
+        self.receiver.photo_stored.connect(self.confirm_stored, Qt.DirectConnection)
+        
     def setup_handlers(self):
         @self.sio.on('connect')
         def on_connect():
             self.connected.emit()
-            self.sio.emit('register_desktop', {'session_id': self.session_id})
+            self.register()
             
         @self.sio.on('disconnect')
         def on_disconnect():
             self.disconnected.emit()
+            self.wake.set()
             
+        # Photo data goes straight to the receiver, never through the UI thread
         @self.sio.on('photo_received')
         def on_photo(data):
-            self.photo_received.emit(data)
+            self.receiver.receive_photo(data)
+            self.ack_delivery(data)
+            
+        @self.sio.on('batch_manifest')
+        def on_batch_manifest(data):
+            self.receiver.batch_started.emit(data)
+            
+        # Chunked uploads are streamed as begin / chunk... / end
+        @self.sio.on('photo_begin')
+        def on_photo_begin(data):
+            self.receiver.begin_upload(data)
+            
+        @self.sio.on('photo_chunk')
+        def on_photo_chunk(data):
+            self.receiver.write_chunk(data)
+            self.ack_delivery(data)
+            
+        @self.sio.on('photo_end')
+        def on_photo_end(data):
+            self.receiver.end_upload(data)
+            
+        @self.sio.on('photo_abort')
+        def on_photo_abort(data):
+            self.receiver.abort_upload(data.get('upload_id'))
+            
+        # Sent by the server a few times a second per upload, not per chunk
+        @self.sio.on('upload_progress')
+        def on_upload_progress(data):
+            self.relay_progress.emit(data.get('upload_id') or '', data.get('relayed') or 0, float(data.get('rate') or 0))
             
     def run(self):
+        while self.should_run:
+            if not self.sio.connected:
+                self.connect_with_backoff()
+                continue
+                
+            # Heartbeat so the server does not expire this session
+            if self.wake.wait(self.HEARTBEAT_INTERVAL):
+                self.wake.clear()
+                continue
+            try:
+                self.sio.emit('heartbeat', {
+                    'session_id': self.session_id,
+                    'upload_options': self.upload_options,
+                    'flow_control': True,
+                    'delivery_acks': True
+                })
+            except Exception:
+                pass
+                
+    def connect_with_backoff(self):
+        """Connect, retrying with backoff until connected or stopped"""
+        down_since = time.monotonic()
+        attempt = 0
+        while self.should_run:
+            try:
+                self.wake.clear()
+                self.sio.connect(self.server_url, transports=['websocket'], wait_timeout=self.CONNECT_TIMEOUT)
+                self.reconnected.emit(time.monotonic() - down_since, attempt)
+                return
+            except Exception as e:
+                if attempt == 0:
+                    self.connection_error.emit(str(e))
+            delay = backoff_delay(attempt, self.RECONNECT_DELAY, self.RECONNECT_DELAY_MAX)
+            attempt += 1
+            self.reconnecting.emit(attempt, delay)
+            if self.stop_event.wait(delay):
+                return
+            
+    def register(self):
+        """Register this desktop (and its upload options) with the server"""
+        self.sio.emit('register_desktop', {
+            'session_id': self.session_id,
+            'upload_options': self.upload_options,
+            'flow_control': True,  # we acknowledge every payload (see ack_delivery)
+            'delivery_acks': True  # and confirm every saved photo (see confirm_stored)
+        })
+        
+    def ack_delivery(self, data):
+        """Tell the server a payload has been taken off the wire.
+        
+        The server limits the bytes relayed to us but not yet acknowledged,
+        so a slow link makes phones wait instead of growing server buffers.
+        """
+        ack_id = data.get('ack_id')
+        if ack_id is not None and self.sio.connected:
+            try:
+                self.sio.emit('desktop_ack', {'session_id': self.session_id, 'ack_id': ack_id})
+            except Exception:
+                pass
+        
+    def confirm_stored(self, upload_id, saved, detail):
+        """Tell the server whether a photo made it to disk.
+        
+        The phone is only told its upload succeeded after this arrives.
+        detail is the saved filename, or the error message.
+        """
+        if not upload_id or not self.sio.connected:
+            return
         try:
-            # Replace with your actual Socket.IO server URL
-            # For production: deploy server to Render, Railway, Heroku, etc.
-            self.sio.connect('https://web-img.onrender.com')
-        except Exception as e:
-            self.connection_error.emit(str(e))
+            self.sio.emit('photo_stored', {
+                'session_id': self.session_id,
+                'upload_id': upload_id,
+                'status': 'ok' if saved else 'error',
+                'filename': detail if saved else None,
+                'message': None if saved else detail
+            })
+        except Exception:
+            pass
+            
+    def set_upload_options(self, options):
+        """Ask phones to resize before uploading (None sends originals)"""
+        self.upload_options = options
+        if self.sio.connected:
+            self.register()
             
     def disconnect(self):
         self.should_run = False
+        self.stop_event.set()
+        self.wake.set()
         if self.sio.connected:
             self.sio.disconnect()
 
+class Task(QRunnable):
+    """Run a callable on a QThreadPool"""
+    def __init__(self, fn, *args):
+        super().__init__()
+        self.fn = fn
+        self.args = args
+        
+    def run(self):
+        self.fn(*self.args)
+
+# Pillow modes that map directly onto a QImage format: (bytes per pixel, format)
+QIMAGE_FORMATS = {
+    'RGB': (3, QImage.Format_RGB888),
+    'RGBA': (4, QImage.Format_RGBA8888),
+    'L': (1, QImage.Format_Grayscale8),
+}
+
+def pil_to_qimage(img):
+    """Wrap a Pillow image's raw pixels in a QImage without re-encoding.
+    
+    The QImage references the bytes from Image.tobytes() directly (PySide
+    keeps them alive for as long as any copy of the QImage exists), so it
+    is safe to hand across threads.
+    """
+    if img.mode not in QIMAGE_FORMATS:
+        has_alpha = 'A' in img.mode or 'transparency' in img.info
+        img = img.convert('RGBA' if has_alpha else 'RGB')
+        
+    bytes_per_pixel, image_format = QIMAGE_FORMATS[img.mode]
+    data = img.tobytes()
+    return QImage(data, img.width, img.height, img.width * bytes_per_pixel, image_format)
+
+# Decode previews at no less than this multiple of the preview size, so the
+# final LANCZOS pass still has real detail to work with
+PREVIEW_REDUCING_GAP = 2.0
+
+def decode_preview(path, size=(400, 300)):
+    """Decode a photo at reduced resolution and shrink it to fit size.
+    
+    JPEGs are decoded with libjpeg's DCT scaling (1/2, 1/4 or 1/8), so a
+    48 MP shot never materializes at full size. Pillow has no scaled decode
+    for WebP or PNG; those are decoded in full and box-reduced by an
+    integer factor before resampling. If the reduced decode fails, the
+    image is decoded again without draft mode.
+    """
+    target = (int(size[0] * PREVIEW_REDUCING_GAP), int(size[1] * PREVIEW_REDUCING_GAP))
+    img = Image.open(path)
+    try:
+        if img.format == 'JPEG':
+            img.draft('RGB', target)
+        img.load()
+    except OSError:
+        img = Image.open(path)
+        img.load()
+        
+    # Resize for preview (maintain aspect ratio)
+    img.thumbnail(size, Image.Resampling.LANCZOS, reducing_gap=PREVIEW_REDUCING_GAP)
+    return img
+
+def make_thumbnail(path, size=(400, 300)):
+    """Decode a saved photo into a preview-sized QImage (safe off the UI thread).
+    
+    Returns a null QImage for a photo that cannot be decoded; it is saved
+    all the same, only without a preview.
+    """
+    try:
+        return pil_to_qimage(decode_preview(path, size))
+    except Exception:
+        return QImage()
+
+class PhotoStore:
+    """Content-addressed index of the photos in the save directory.
+    
+    Maps the sha256 of every saved photo (the digest phones and the relay
+    already compute) to its filename, so a photo sent again becomes a hard
+    link to the first copy instead of a second full write. The index is an
+    append-only file of '<sha256> <filename>' lines read once at startup;
+    later lines win, and entries whose file has been deleted are ignored.
+    """
+    INDEX_NAME = '.photo-index'
+    
+    def __init__(self, save_dir):
+        self.save_dir = save_dir
+        self.index_path = os.path.join(save_dir, self.INDEX_NAME)
+        self.by_digest = {}
+        self.lock = threading.Lock()
+        self.load()
+        
+    def load(self):
+        try:
+            with open(self.index_path, 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            return
+        for line in data.splitlines():
+            digest, sep, filename = line.partition(b' ')
+            if sep and len(digest) == 64 and filename:  # skips a torn last line
+                self.by_digest[digest.decode('ascii')] = filename.decode('utf-8')
+                
+    def lookup(self, digest):
+        """Filename of a stored photo with this sha256, if it still exists"""
+        filename = self.by_digest.get(digest.lower()) if digest else None
+        if filename and os.path.exists(os.path.join(self.save_dir, filename)):
+            return filename
+        return None
+        
+    def add(self, digest, filename):
+        with self.lock:
+            self.by_digest[digest] = filename
+            with open(self.index_path, 'a', encoding='utf-8') as f:
+                f.write(f"{digest} {filename}\n")
+
+class PhotoReceiver(QObject):
+    """Receive pipeline that keeps photo I/O off the UI thread.
+    
+    Socket.IO handlers call into this object from the client's own threads.
+    Chunks are written to disk as they arrive; decoding, saving and building
+    the preview thumbnail run on a QThreadPool. Only the finished thumbnail
+    is signalled back to the UI.
+    """
+    batch_started = Signal(dict)  # batch manifest
+    upload_started = Signal(str, int)  # upload ID, total size in bytes
+    upload_progress = Signal(str, int, int)  # upload ID, bytes written, total size
+    upload_closed = Signal(str)  # upload ID of an upload that was cancelled
+    photo_saved = Signal(str, int, QImage, str)  # filename, size in bytes, thumbnail, batch ID
+    photo_stored = Signal(str, bool, str)  # upload ID, saved, filename or error message
+    photo_duplicate = Signal(str, str)  # filename, filename of the identical photo
+    receive_error = Signal(str)
+    
+    WRITE_BUFFER_SIZE = 1024 * 1024
+    BASE64_BLOCK_SIZE = 4 * 256 * 1024  # base64 characters decoded per write
+    PROGRESS_INTERVAL = 0.2  # seconds between upload_progress signals per upload
+    
+    def __init__(self, save_dir, validate):
+        super().__init__()
+        self.save_dir = save_dir
+        self.validate = validate
+        self.pool = QThreadPool()
+        self.store = PhotoStore(save_dir)
+        
+        # Photos are written here and only renamed into save_dir when
+        # complete; leftovers from a crash are cleared at startup
+        self.part_dir = os.path.join(save_dir, '.incoming')
+        shutil.rmtree(self.part_dir, ignore_errors=True)
+        os.makedirs(self.part_dir, exist_ok=True)
+        
+        self.photo_counter = 0
+        self.counter_lock = threading.Lock()
+        
+        # Chunked uploads being written: {upload_id: state}
+        self.uploads = {}
+        self.uploads_lock = threading.Lock()
+        
+    def new_photo_path(self, mime_type):
+        """Return (filename, filepath) for a newly received photo.
+        
+        A per-process counter after the timestamp keeps names unique, and in
+        arrival order, however many photos arrive in the same second.
+        """
+        with self.counter_lock:
+            self.photo_counter += 1
+            counter = self.photo_counter
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        ext = mime_type.split('/')[-1]
+        filename = f"photo_{timestamp}_{counter:06d}.{ext}"
+        return filename, os.path.join(self.save_dir, filename)
+        
+    def new_part_path(self):
+        """Return a path for a photo that is still being written"""
+        return os.path.join(self.part_dir, f"{uuid.uuid4().hex}.part")
+        
+    def _link_new_photo(self, source, mime_type):
+        """Hard-link source under a fresh photo name.
+        
+        os.link never replaces an existing file, so a name taken meanwhile
+        (say, by another app writing to the same folder) moves on to the
+        next one instead of overwriting it.
+        """
+        while True:
+            filename, filepath = self.new_photo_path(mime_type)
+            try:
+                os.link(source, filepath)
+                return filename, filepath
+            except FileExistsError:
+                continue
+                
+    def _place(self, part_path, mime_type):
+        """Give a complete partial file its final name, atomically"""
+        try:
+            filename, filepath = self._link_new_photo(part_path, mime_type)
+        except OSError:
+            # No hard links on this filesystem; counter names are still
+            # unique within this process
+            filename, filepath = self.new_photo_path(mime_type)
+            os.rename(part_path, filepath)
+            return filename, filepath
+        os.remove(part_path)
+        return filename, filepath
+        
+    def _commit(self, part_path, digest, mime_type):
+        """Move a verified partial file into place, unless the photo is already stored"""
+        existing = self.store.lookup(digest)
+        if existing:
+            os.remove(part_path)
+            return self._save_duplicate(existing, mime_type)
+        filename, filepath = self._place(part_path, mime_type)
+        self.store.add(digest, filename)
+        return filename, filepath
+        
+    def _save_duplicate(self, existing, mime_type):
+        """Record a photo that is already stored as a hard link to the first copy.
+        
+        Where hard links are not supported, the existing file is reported
+        instead of writing the bytes again.
+        """
+        existing_path = os.path.join(self.save_dir, existing)
+        try:
+            filename, filepath = self._link_new_photo(existing_path, mime_type)
+        except OSError:
+            filename, filepath = existing, existing_path
+        self.photo_duplicate.emit(filename, existing)
+        return filename, filepath
+        
+    def receive_photo(self, data):
+        """Queue a single-message photo for saving"""
+        self.pool.start(Task(self._save_photo, data))
+        
+    def _save_photo(self, data):
+        upload_id = data.get('upload_id') or ''
+        try:
+            photo = data.get('photo')
+            mime_type = data.get('mime_type', 'image/jpeg')
+            file_size = data.get('file_size', 0)
+            
+            # Validate
+            is_valid, message = self.validate(photo, mime_type, file_size)
+            if not is_valid:
+                self.photo_stored.emit(upload_id, False, message)
+                self.receive_error.emit(f"Validation failed: {message}")
+                return
+                
+            # Binary uploads arrive as raw bytes and are hashed before anything
+            # is written, so a photo that is already stored is not written again
+            if isinstance(photo, (bytes, bytearray)):
+                digest = hashlib.sha256(photo).hexdigest()
+                existing = self.store.lookup(digest)
+                if existing:
+                    filename, filepath = self._save_duplicate(existing, mime_type)
+                else:
+                    part_path = self.new_part_path()
+                    with open(part_path, 'wb', buffering=self.WRITE_BUFFER_SIZE) as f:
+                        f.write(photo)
+                    filename, filepath = self._place(part_path, mime_type)
+                    self.store.add(digest, filename)
+                written = len(photo)
+            else:
+                # Legacy clients send base64, which is decoded (and hashed)
+                # block by block rather than all at once
+                part_path = self.new_part_path()
+                hasher = hashlib.sha256()
+                written = 0
+                with open(part_path, 'wb', buffering=self.WRITE_BUFFER_SIZE) as f:
+                    for start in range(0, len(photo), self.BASE64_BLOCK_SIZE):
+                        block = base64.b64decode(photo[start:start + self.BASE64_BLOCK_SIZE])
+                        hasher.update(block)
+                        written += f.write(block)
+                filename, filepath = self._commit(part_path, hasher.hexdigest(), mime_type)
+                        
+            self.photo_stored.emit(upload_id, True, filename)
+            self.photo_saved.emit(filename, written, make_thumbnail(filepath), '')
+            
+        except Exception as e:
+            self.photo_stored.emit(upload_id, False, 'Desktop could not save the photo')
+            self.receive_error.emit(f"Error processing photo: {str(e)}")
+            
+    def begin_upload(self, data):
+        """Start writing a chunked upload to a partial file"""
+        upload_id = data.get('upload_id')
+        mime_type = data.get('mime_type', 'image/jpeg')
+        total_size = data.get('total_size', 0)
+        
+        is_valid, message = self.validate(None, mime_type, total_size)
+        if not is_valid:
+            self.receive_error.emit(f"Validation failed: {message}")
+            return
+            
+        try:
+            # A photo we already have (by its declared sha256) is not written
+            # at all; the relay checks the bytes against that digest
+            duplicate_of = self.store.lookup(data.get('sha256'))
+            part_path = None if duplicate_of else self.new_part_path()
+            upload = {
+                'upload_id': upload_id,
+                'file': None if duplicate_of else open(part_path, 'wb', buffering=self.WRITE_BUFFER_SIZE),
+                'part_path': part_path,
+                'duplicate_of': duplicate_of,
+                'mime_type': mime_type,
+                'total_size': total_size,
+                'sha256': data.get('sha256'),
+                'batch_id': data.get('batch_id') or '',
+                'hasher': hashlib.sha256(),
+                'written': 0,
+                'progress_at': 0.0,
+                'pending': {},  # out-of-order chunks: {offset: data}
+                'ended': False,
+                'lock': threading.Lock()
+            }
+            with self.uploads_lock:
+                self.uploads[upload_id] = upload
+            self.upload_started.emit(upload_id, total_size)
+        except Exception as e:
+            self.receive_error.emit(f"Error starting upload: {str(e)}")
+            
+    def write_chunk(self, data):
+        """Append one chunk of a chunked upload.
+        
+        The Socket.IO client may dispatch events on separate threads, so
+        chunks that overtake each other are held until the gap is filled.
+        """
+        upload_id = data.get('upload_id')
+        upload = self.uploads.get(upload_id)
+        chunk = data.get('data')
+        if not upload or not chunk:
+            return
+            
+        progress = None
+        try:
+            with upload['lock']:
+                if upload['file'] is None:
+                    return
+                offset = data.get('offset')
+                if offset == upload['written']:
+                    self._append(upload, chunk)
+                    while upload['written'] in upload['pending']:
+                        self._append(upload, upload['pending'].pop(upload['written']))
+                elif isinstance(offset, int) and offset > upload['written']:
+                    upload['pending'][offset] = chunk
+                ready = self._close_if_complete(upload)
+                
+                # Progress is signalled a few times a second, not per chunk
+                now = time.monotonic()
+                if now - upload['progress_at'] >= self.PROGRESS_INTERVAL:
+                    upload['progress_at'] = now
+                    progress = upload['written']
+        except Exception as e:
+            self.receive_error.emit(f"Error writing photo: {str(e)}")
+            self.abort_upload(upload_id)
+            return
+            
+        if progress is not None:
+            self.upload_progress.emit(upload_id, progress, upload['total_size'])
+        if ready:
+            self._finish_upload(upload_id, upload)
+            
+    def _append(self, upload, chunk):
+        upload['file'].write(chunk)
+        upload['hasher'].update(chunk)
+        upload['written'] += len(chunk)
+        
+    def _close_if_complete(self, upload):
+        """Close the partial file once the end marker and all bytes are in"""
+        if upload['ended'] and upload['written'] >= upload['total_size'] and upload['file'] is not None:
+            upload['file'].close()
+            upload['file'] = None
+            return True
+        return False
+        
+    def end_upload(self, data):
+        """Mark a chunked upload as complete on the server side"""
+        upload_id = data.get('upload_id')
+        upload = self.uploads.get(upload_id)
+        if not upload:
+            # Rejected at photo_begin (or aborted): the phone must not wait for it
+            self.photo_stored.emit(upload_id or '', False, 'Photo was rejected by the desktop')
+            return
+            
+        with upload['lock']:
+            upload['ended'] = True
+            if data.get('sha256'):
+                upload['sha256'] = data['sha256']
+            ready = self._close_if_complete(upload) or upload['duplicate_of'] is not None
+            
+        if ready:
+            self._finish_upload(upload_id, upload)
+            
+    def _finish_upload(self, upload_id, upload):
+        with self.uploads_lock:
+            self.uploads.pop(upload_id, None)
+        self.pool.start(Task(self._store_upload, upload))
+        
+    def _store_upload(self, upload):
+        """Verify a completed chunked upload and move it into place"""
+        try:
+            if upload['duplicate_of']:
+                filename, filepath = self._save_duplicate(upload['duplicate_of'], upload['mime_type'])
+                self.photo_stored.emit(upload['upload_id'], True, filename)
+                self.photo_saved.emit(filename, upload['total_size'], make_thumbnail(filepath), upload['batch_id'])
+                return
+                
+            expected = upload['sha256']
+            digest = upload['hasher'].hexdigest()
+            if upload['written'] != upload['total_size'] or (expected and expected.lower() != digest):
+                os.remove(upload['part_path'])
+                self.photo_stored.emit(upload['upload_id'], False, 'Photo arrived incomplete or corrupted')
+                self.receive_error.emit("Incomplete or corrupted photo discarded")
+                return
+                
+            filename, filepath = self._commit(upload['part_path'], digest, upload['mime_type'])
+            self.photo_stored.emit(upload['upload_id'], True, filename)
+            self.photo_saved.emit(filename, upload['written'], make_thumbnail(filepath), upload['batch_id'])
+            
+        except Exception as e:
+            self.photo_stored.emit(upload['upload_id'], False, 'Desktop could not save the photo')
+            self.receive_error.emit(f"Error processing photo: {str(e)}")
+            
+    def abort_upload(self, upload_id):
+        """Discard a chunked upload that was cancelled"""
+        with self.uploads_lock:
+            upload = self.uploads.pop(upload_id, None)
+        if not upload:
+            return
+            
+        with upload['lock']:
+            try:
+                if upload['file'] is not None:
+                    upload['file'].close()
+                    upload['file'] = None
+                if upload['part_path']:
+                    os.remove(upload['part_path'])
+            except OSError:
+                pass
+        self.upload_closed.emit(upload_id)
+        self.receive_error.emit("Photo upload cancelled")
+        
+    def shutdown(self):
+        """Abort partial uploads and wait for queued work"""
+        for upload_id in list(self.uploads):
+            self.abort_upload(upload_id)
+        self.pool.waitForDone(5000)
+
 class PhotoReceiverApp(QMainWindow):
     def __init__(self):
         super().__init__()
@@ -65,19 +725,56 @@ class PhotoReceiverApp(QMainWindow):
         self.MAX_FILE_SIZE = 10 * 1024 * 1024  # 10MB
         self.ALLOWED_TYPES = {'image/jpeg', 'image/png', 'image/jpg', 'image/webp'}
         
+        # Optional phone-side resize before upload (opt-in)
+        self.RESIZE_OPTIONS = {'max_dimension': 1920, 'quality': 0.85}
+        
         # Create save directory
         self.save_dir = "received_photos"
         os.makedirs(self.save_dir, exist_ok=True)
         
+        # Batches being received: {batch_id: progress}
+        self.batches = {}
+        
+        # Where the desktop connects, and where the QR code sends phones.
+        # In local mode both are this computer; the relay is still starting
+        # when the first connect is tried, which the reconnect loop absorbs.
+        self.server_url = self.public_url = SERVER_URL
+        self.local_relay = None
+        if RELAY_MODE == 'local':
+            self.local_relay = LocalRelay(LOCAL_RELAY_PORT)
+            self.local_relay.start()
+            self.server_url = self.local_relay.local_url
+            self.public_url = self.local_relay.lan_url
+        
+        # Time each outage lasted until the connection was back, in seconds
+        self.reconnect_times = []
+        self.has_connected = False
+        
+        # Chunked uploads in progress, one progress bar each: {upload_id: transfer}
+        self.transfers = {}
+        
         # Setup UI
         self.init_ui()
         
+        # Photos are saved and thumbnailed off the UI thread
+        self.receiver = PhotoReceiver(self.save_dir, self.validate_photo)
+        self.receiver.batch_started.connect(self.on_batch_started)
+        self.receiver.upload_started.connect(self.on_upload_started)
+        self.receiver.upload_progress.connect(self.on_upload_progress)
+        self.receiver.upload_closed.connect(self.remove_transfer)
+        self.receiver.photo_stored.connect(self.on_photo_stored)
+        self.receiver.photo_saved.connect(self.on_photo_saved)
+        self.receiver.photo_duplicate.connect(self.on_photo_duplicate)
+        self.receiver.receive_error.connect(self.on_receive_error)
+        
         # Start Socket.IO connection in thread
-        self.socket_thread = SocketIOThread(self.session_id)
+        self.socket_thread = SocketIOThread(self.session_id, self.receiver, self.server_url)
         self.socket_thread.connected.connect(self.on_connected)
         self.socket_thread.disconnected.connect(self.on_disconnected)
-        self.socket_thread.photo_received.connect(self.handle_photo)
         self.socket_thread.connection_error.connect(self.on_connection_error)
+        self.socket_thread.reconnecting.connect(self.on_reconnecting)
+        self.socket_thread.reconnected.connect(self.on_reconnected)
+        self.socket_thread.relay_progress.connect(self.on_relay_progress)
         self.socket_thread.start()
         
     def init_ui(self):
@@ -233,12 +930,27 @@ class PhotoReceiverApp(QMainWindow):
         save_container.addWidget(save_path)
         info_layout.addLayout(save_container)
         
+        # Upload size
+        max_dimension = self.RESIZE_OPTIONS['max_dimension']
+        quality = int(self.RESIZE_OPTIONS['quality'] * 100)
+        self.resize_checkbox = QCheckBox(f"Ask phones to resize photos (max {max_dimension}px, {quality}% quality)")
+        self.resize_checkbox.setStyleSheet("font-weight: normal; font-size: 12px; color: #666;")
+        self.resize_checkbox.toggled.connect(self.on_resize_toggled)
+        info_layout.addWidget(self.resize_checkbox)
+        
         info_layout.addStretch()
         info_group.setLayout(info_layout)
         top_layout.addWidget(info_group, 1)
         
         main_layout.addLayout(top_layout)
         
+        # Uploads in progress (hidden while there are none)
+        self.transfers_group = QGroupBox("Receiving")
+        self.transfers_layout = QVBoxLayout()
+        self.transfers_group.setLayout(self.transfers_layout)
+        self.transfers_group.hide()
+        main_layout.addWidget(self.transfers_group)
+        
         # Activity Log
         log_group = QGroupBox("Activity Log")
         log_layout = QVBoxLayout()
@@ -270,12 +982,14 @@ class PhotoReceiverApp(QMainWindow):
         main_layout.addWidget(preview_group)
         
         self.log_message("Application started. Waiting for connection...")
+        if self.local_relay:
+            self.log_message(f"📡 Local relay on {self.public_url} (phones must be on the same network)")
         
     def generate_qr_code(self):
         """Generate QR code with session URL"""
-        # URL that phone will open - replace with your actual server URL
-        # For production, deploy to Render, Heroku, Railway, etc.
-        server_url = f"https://web-img.onrender.com/upload?session={self.session_id}"
+        # URL that phone will open: the relay server (RELAY_SERVER_URL), or
+        # this computer's LAN address in local relay mode
+        server_url = f"{self.public_url}/upload?session={self.session_id}"
         
         # For local testing with ngrok:
         # server_url = f"http://your-ngrok-url.ngrok.io/upload?session={self.session_id}"
@@ -289,11 +1003,7 @@ class PhotoReceiverApp(QMainWindow):
         img.show()
         
         # Convert PIL image to QPixmap
-        img_byte_arr = io.BytesIO()
-        img.save(img_byte_arr, format='PNG')
-        img_byte_arr.seek(0)
-        
-        qimage = QImage.fromData(img_byte_arr.getvalue())
+        qimage = pil_to_qimage(img.convert('L'))
 
         # Scale QR code to fit label
         target_width = self.qr_label.width()
@@ -303,6 +1013,14 @@ class PhotoReceiverApp(QMainWindow):
 
         self.qr_label.setPixmap(scaled_pixmap)
         
+    def on_resize_toggled(self, checked):
+        """Send the resize preference to the server"""
+        self.socket_thread.set_upload_options(self.RESIZE_OPTIONS if checked else None)
+        if checked:
+            self.log_message(f"📐 Phones will resize photos to {self.RESIZE_OPTIONS['max_dimension']}px")
+        else:
+            self.log_message("📐 Phones will send original photos")
+        
     def on_connected(self):
         """Handle successful connection"""
         self.status_label.setText("✅ Connected")
@@ -329,6 +1047,24 @@ class PhotoReceiverApp(QMainWindow):
         """)
         self.log_message("❌ Disconnected from server")
         
+    def on_reconnecting(self, attempt, delay):
+        """A connection attempt failed; another follows after delay seconds"""
+        self.status_label.setText(f"⏳ Reconnecting (attempt {attempt + 1})...")
+        if attempt == 1 or attempt % 5 == 0:
+            self.log_message(f"🔄 Retrying connection in {delay:.1f}s (attempt {attempt + 1})")
+            
+    def on_reconnected(self, seconds, failed_attempts):
+        """Show how long it took to (re)connect"""
+        if not self.has_connected:
+            self.has_connected = True
+            self.log_message(f"⏱️ Connected in {seconds:.1f}s")
+            return
+        self.reconnect_times.append(seconds)
+        slowest = max(self.reconnect_times)
+        self.status_label.setText(f"✅ Connected (back in {seconds:.1f}s)")
+        self.log_message(f"⏱️ Reconnected in {seconds:.1f}s after {failed_attempts} failed attempt(s) "
+                         f"({len(self.reconnect_times)} reconnect(s), slowest {slowest:.1f}s)")
+        
     def on_connection_error(self, error):
         """Handle connection error"""
         self.status_label.setText("❌ Connection Failed")
@@ -354,66 +1090,116 @@ class PhotoReceiverApp(QMainWindow):
             
         return True, "Valid"
         
-    def handle_photo(self, data):
-        """Handle received photo"""
-        try:
-            # Extract photo data
-            photo_base64 = data.get('photo')
-            mime_type = data.get('mime_type', 'image/jpeg')
-            file_size = data.get('file_size', 0)
-            
-            # Validate
-            is_valid, message = self.validate_photo(photo_base64, mime_type, file_size)
-            if not is_valid:
-                self.log_message(f"❌ Validation failed: {message}")
-                return
-                
-            # Decode base64
-            photo_data = base64.b64decode(photo_base64)
-            
-            # Save to file
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            ext = mime_type.split('/')[-1]
-            filename = f"photo_{timestamp}.{ext}"
-            filepath = os.path.join(self.save_dir, filename)
-            
-            with open(filepath, 'wb') as f:
-                f.write(photo_data)
-                
-            size_kb = file_size / 1024
-            self.log_message(f"✅ Photo received: {filename} ({size_kb:.1f} KB)")
-            
-            # Update preview
-            self.update_preview(photo_data)
+    def on_batch_started(self, manifest):
+        """Handle the manifest announcing a batch of photos"""
+        count = manifest.get('count', 0)
+        total_size = manifest.get('total_size', 0)
+        self.batches[manifest.get('batch_id')] = {
+            'count': count,
+            'saved': 0,
+            'started': time.perf_counter()
+        }
+        self.log_message(f"📦 Receiving {count} photo(s) ({total_size / (1024 * 1024):.1f} MB)")
+        
+        # Make sure the whole batch fits before the first photo lands
+        free = shutil.disk_usage(self.save_dir).free
+        if free < total_size:
+            self.log_message(f"⚠️ Only {free / (1024 * 1024):.1f} MB free in {os.path.abspath(self.save_dir)}")
+        
+    def on_upload_started(self, upload_id, total_size):
+        """Handle the start of a chunked upload: add a progress bar for it"""
+        self.log_message(f"⬇️ Receiving photo ({total_size / 1024:.1f} KB)...")
+        
+        label = QLabel(f"0 / {total_size / (1024 * 1024):.1f} MB")
+        label.setStyleSheet("font-weight: normal; font-size: 12px; color: #666;")
+        bar = QProgressBar()
+        bar.setRange(0, max(total_size, 1))
+        bar.setValue(0)
+        self.transfers_layout.addWidget(label)
+        self.transfers_layout.addWidget(bar)
+        self.transfers[upload_id] = {
+            'label': label,
+            'bar': bar,
+            'total_size': total_size,
+            'written': 0,
+            'link_rate': 0.0,
+            'started': time.perf_counter()
+        }
+        self.transfers_group.show()
+        
+    def on_upload_progress(self, upload_id, written, total_size):
+        """Update an upload's progress bar with the bytes written to disk"""
+        transfer = self.transfers.get(upload_id)
+        if transfer:
+            transfer['written'] = written
+            self.update_transfer(transfer)
             
-        except Exception as e:
-            self.log_message(f"❌ Error processing photo: {str(e)}")
+    def on_relay_progress(self, upload_id, relayed, link_rate):
+        """Record the phone-to-server rate the server measured for an upload's session"""
+        transfer = self.transfers.get(upload_id)
+        if transfer:
+            transfer['link_rate'] = link_rate
+            self.update_transfer(transfer)
             
-    def update_preview(self, photo_data):
+    def update_transfer(self, transfer):
+        """Show bytes written, local write rate and the server's link rate"""
+        written = transfer['written']
+        elapsed = max(time.perf_counter() - transfer['started'], 1e-6)
+        text = (f"{written / (1024 * 1024):.1f} / {transfer['total_size'] / (1024 * 1024):.1f} MB"
+                f" · {written / elapsed / (1024 * 1024):.1f} MB/s")
+        if transfer['link_rate']:
+            text += f" (link {transfer['link_rate'] / (1024 * 1024):.1f} MB/s)"
+        transfer['label'].setText(text)
+        transfer['bar'].setValue(min(written, transfer['total_size']))
+        
+    def on_photo_stored(self, upload_id, saved, detail):
+        """A chunked upload is finished, one way or the other"""
+        self.remove_transfer(upload_id)
+        
+    def remove_transfer(self, upload_id):
+        """Drop an upload's progress bar"""
+        transfer = self.transfers.pop(upload_id, None)
+        if not transfer:
+            return
+        for widget in (transfer['label'], transfer['bar']):
+            self.transfers_layout.removeWidget(widget)
+            widget.deleteLater()
+        if not self.transfers:
+            self.transfers_group.hide()
+        
+    def on_photo_saved(self, filename, file_size, thumbnail, batch_id):
+        """Handle a photo that has been written to disk"""
+        size_kb = file_size / 1024
+        self.log_message(f"✅ Photo received: {filename} ({size_kb:.1f} KB)")
+        if thumbnail.isNull():
+            self.log_message(f"❌ Error updating preview: cannot decode {filename}")
+        else:
+            self.update_preview(thumbnail)
+        
+        batch = self.batches.get(batch_id)
+        if batch:
+            batch['saved'] += 1
+            elapsed = max(time.perf_counter() - batch['started'], 1e-6)
+            rate = batch['saved'] / elapsed
+            self.log_message(f"📦 {batch['saved']}/{batch['count']} photos ({rate:.1f} photos/s)")
+            if batch['saved'] >= batch['count']:
+                del self.batches[batch_id]
+        
+    def on_photo_duplicate(self, filename, original):
+        """Handle a photo that was already stored (no second copy written)"""
+        if filename == original:
+            self.log_message(f"♻️ Already received as {original}")
+        else:
+            self.log_message(f"♻️ {filename} is a duplicate of {original} (hard link, no extra space)")
+        
+    def on_receive_error(self, message):
+        """Handle a failed or cancelled photo"""
+        self.log_message(f"❌ {message}")
+        
+    def update_preview(self, thumbnail):
         """Update photo preview"""
-        try:
-            img = Image.open(io.BytesIO(photo_data))
-            
-            # Convert to RGB if necessary
-            if img.mode != 'RGB':
-                img = img.convert('RGB')
-            
-            # Resize for preview (maintain aspect ratio)
-            img.thumbnail((400, 300), Image.Resampling.LANCZOS)
-            
-            # Convert to QPixmap
-            img_byte_arr = io.BytesIO()
-            img.save(img_byte_arr, format='PNG')
-            img_byte_arr.seek(0)
-            
-            qimage = QImage.fromData(img_byte_arr.getvalue())
-            pixmap = QPixmap.fromImage(qimage)
-            
-            self.preview_label.setPixmap(pixmap)
-            self.preview_label.setStyleSheet("")
-            
-        except Exception as e:
-            self.log_message(f"❌ Error updating preview: {str(e)}")
+        self.preview_label.setPixmap(QPixmap.fromImage(thumbnail))
+        self.preview_label.setStyleSheet("")
             
     def log_message(self, message):
         """Add message to log"""
@@ -431,6 +1217,9 @@ class PhotoReceiverApp(QMainWindow):
         if hasattr(self, 'socket_thread'):
             self.socket_thread.disconnect()
             self.socket_thread.wait()
+        self.receiver.shutdown()
+        if self.local_relay:
+            self.local_relay.stop()
         event.accept()
 
 def main():
@@ -0,0 +1,126 @@
+"""Batch upload throughput (photos/s) with pipelined chunked uploads.
+
+A simulated phone announces a batch manifest and uploads every photo with
+the upload_begin / upload_chunk / upload_end protocol, keeping up to
+--in-flight uploads running at once (as upload.html does). The desktop
+counts photo_end events.
+
+Usage: python benchmarks/bench_batch_upload.py [--photos N] [--size-kb KB]
+"""
+import argparse
+import hashlib
+import queue
+import threading
+import time
+import uuid
+
+import common
+
+import socketio
+
+CHUNK_SIZE = 512 * 1024
+WINDOWS = (1, 3, 6)
+
+
+def upload_file(phone, session_id, batch_id, upload_id, payload):
+    """Send one photo with the chunked protocol, like upload.html"""
+    ack = phone.call('upload_begin', {
+        'upload_id': upload_id,
+        'batch_id': batch_id,
+        'session_id': session_id,
+        'mime_type': 'image/jpeg',
+        'total_size': len(payload),
+        'sha256': hashlib.sha256(payload).hexdigest(),
+    }, timeout=30)
+    while ack['offset'] < len(payload):
+        ack = phone.call('upload_chunk', {
+            'upload_id': upload_id,
+            'seq': ack['next_seq'],
+            'data': payload[ack['offset']:ack['offset'] + CHUNK_SIZE],
+        }, timeout=30)
+        if ack['status'] == 'busy':
+            time.sleep(ack['retry_after'] / 1000)
+        elif ack['status'] != 'ok':
+            raise RuntimeError(ack.get('message'))
+    ack = phone.call('upload_end', {'upload_id': upload_id}, timeout=30)
+    if ack['status'] != 'ok':
+        raise RuntimeError(ack.get('message'))
+
+
+def run_batch(url, photos, payload, in_flight):
+    session_id = str(uuid.uuid4())
+    done = threading.Event()
+    received = []
+
+    desktop = common.desktop_client()
+    registered = threading.Event()
+    desktop.on('registration_success', lambda data: registered.set())
+
+    @desktop.on('photo_end')
+    def on_end(data):
+        received.append(data['upload_id'])
+        if len(received) == photos:
+            done.set()
+
+    desktop.connect(url, transports=['websocket'])
+    desktop.emit('register_desktop', {'session_id': session_id})
+    registered.wait(10)
+
+    phone = socketio.Client()
+    phone.connect(url, transports=['websocket'])
+
+    batch_id = uuid.uuid4().hex
+    upload_ids = [uuid.uuid4().hex for _ in range(photos)]
+    start = time.perf_counter()
+    phone.call('batch_begin', {
+        'batch_id': batch_id,
+        'session_id': session_id,
+        'items': [{'upload_id': upload_id, 'mime_type': 'image/jpeg', 'size': len(payload)}
+                  for upload_id in upload_ids],
+    }, timeout=30)
+
+    pending = queue.Queue()
+    for upload_id in upload_ids:
+        pending.put(upload_id)
+
+    def worker():
+        while True:
+            try:
+                upload_id = pending.get_nowait()
+            except queue.Empty:
+                return
+            upload_file(phone, session_id, batch_id, upload_id, payload)
+
+    workers = [threading.Thread(target=worker) for _ in range(in_flight)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    if not done.wait(60):
+        raise RuntimeError(f"Desktop received {len(received)}/{photos} photos")
+    elapsed = time.perf_counter() - start
+
+    phone.disconnect()
+    desktop.disconnect()
+    return photos / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--url', help='Relay server URL (default: start one in-process)')
+    parser.add_argument('--photos', type=int, default=50)
+    parser.add_argument('--size-kb', type=int, default=1024)
+    args = parser.parse_args()
+
+    common.quiet_logging()
+    url = args.url or common.start_server()
+    payload = common.fake_photo(args.size_kb * 1024)
+
+    print(f"{args.photos} photos of {args.size_kb} KB")
+    print(f"{'in flight':>10} {'photos/s':>9}")
+    for in_flight in WINDOWS:
+        print(f"{in_flight:>10} {run_batch(url, args.photos, payload, in_flight):>9.1f}")
+
+
+if __name__ == '__main__':
+    main()
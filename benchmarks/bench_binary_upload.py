@@ -0,0 +1,100 @@
+"""Compare binary vs base64 uploads: bytes on the wire and relay latency.
+
+Usage: python benchmarks/bench_binary_upload.py [--runs N]
+"""
+import argparse
+import base64
+import os
+import threading
+import time
+
+import common
+
+import socketio
+from socketio import packet
+
+SIZES_MB = (1, 5, 10)
+
+
+def wire_bytes(payload):
+    """Size of the encoded Socket.IO event packet(s) for an upload"""
+    pkt = packet.Packet(packet.EVENT, data=['upload_photo', {
+        'session_id': 'bench',
+        'photo': payload,
+        'mime_type': 'image/jpeg',
+        'file_size': 0,
+    }])
+    encoded = pkt.encode()
+    if not isinstance(encoded, list):
+        encoded = [encoded]
+    return sum(len(part) for part in encoded)
+
+
+def relay_latency(url, payload, file_size, runs):
+    """Median time from phone emit to desktop receive, in milliseconds"""
+    session_id = f"bench-{os.getpid()}-{time.time_ns()}"
+    received = threading.Event()
+    registered = threading.Event()
+    errors = []
+
+    desktop = socketio.Client()
+    phone = socketio.Client()
+
+    @desktop.on('registration_success')
+    def on_registered(data):
+        registered.set()
+
+    @desktop.on('photo_received')
+    def on_photo(data):
+        received.set()
+
+    desktop.connect(url, transports=['websocket'])
+    desktop.emit('register_desktop', {'session_id': session_id})
+    registered.wait(5)
+    phone.connect(url, transports=['websocket'])
+
+    @phone.on('upload_error')
+    def on_error(data):
+        errors.append(data.get('message'))
+        received.set()
+
+    timings = []
+    for _ in range(runs):
+        received.clear()
+        start = time.perf_counter()
+        phone.emit('upload_photo', {
+            'session_id': session_id,
+            'photo': payload,
+            'mime_type': 'image/jpeg',
+            'file_size': file_size,
+        })
+        if not received.wait(30):
+            raise RuntimeError('Timed out waiting for relayed photo')
+        if errors:
+            raise RuntimeError(f"Upload rejected: {errors[0]}")
+        timings.append((time.perf_counter() - start) * 1000)
+
+    phone.disconnect()
+    desktop.disconnect()
+    return common.percentile(timings, 50)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--runs', type=int, default=5)
+    args = parser.parse_args()
+
+    url = common.start_server()
+
+    print(f"{'size':>6} {'mode':>7} {'wire bytes':>12} {'overhead':>9} {'p50 ms':>9}")
+    for size_mb in SIZES_MB:
+        raw = common.fake_photo(size_mb * 1024 * 1024)
+        for mode, payload in (('binary', raw), ('base64', base64.b64encode(raw).decode('ascii'))):
+            size = wire_bytes(payload)
+            overhead = (size / len(raw) - 1) * 100
+            latency = relay_latency(url, payload, len(raw), args.runs)
+            print(f"{size_mb:>4}MB {mode:>7} {size:>12,} {overhead:>8.1f}% {latency:>9.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+"""UI-thread blocking time per received photo in the desktop app.
+
+Compares the previous path (base64 decode, file write and preview built
+in the Qt slot) with PhotoReceiver, which does that work on a thread pool
+and only hands the UI a finished thumbnail. Also reports the longest
+event-loop stall seen while the photos were processed.
+
+Usage: QT_QPA_PLATFORM=offscreen python benchmarks/bench_gui_receive.py [--photos N]
+"""
+import argparse
+import base64
+import io
+import os
+import tempfile
+import time
+
+import common  # noqa: F401  (puts the repo root on sys.path)
+
+from PIL import Image
+from PySide6.QtCore import QEventLoop, QTimer
+from PySide6.QtGui import QImage, QPixmap
+from PySide6.QtWidgets import QApplication, QLabel
+
+from GUI import PhotoReceiver
+
+
+def make_photo(width, height):
+    """A noisy JPEG that compresses roughly like a camera shot"""
+    img = Image.frombytes('RGB', (width, height), os.urandom(width * height * 3))
+    buf = io.BytesIO()
+    img.save(buf, format='JPEG', quality=85)
+    return buf.getvalue()
+
+
+class StallMonitor:
+    """Measures the longest gap between 1 ms timer ticks on the UI thread"""
+
+    def __init__(self):
+        self.last = time.perf_counter()
+        self.max_gap = 0.0
+        self.timer = QTimer()
+        self.timer.timeout.connect(self.tick)
+        self.timer.start(1)
+
+    def tick(self):
+        now = time.perf_counter()
+        self.max_gap = max(self.max_gap, now - self.last)
+        self.last = now
+
+
+def legacy_handle_photo(data, save_dir, label):
+    """The previous handle_photo/update_preview, run on the UI thread"""
+    photo_data = base64.b64decode(data['photo'])
+    with open(os.path.join(save_dir, f"legacy_{time.time_ns()}.jpeg"), 'wb') as f:
+        f.write(photo_data)
+    img = Image.open(io.BytesIO(photo_data))
+    if img.mode != 'RGB':
+        img = img.convert('RGB')
+    img.thumbnail((400, 300), Image.Resampling.LANCZOS)
+    buf = io.BytesIO()
+    img.save(buf, format='PNG')
+    label.setPixmap(QPixmap.fromImage(QImage.fromData(buf.getvalue())))
+
+
+def run_legacy(app, photos, save_dir, label):
+    monitor = StallMonitor()
+    timings = []
+    for data in photos:
+        start = time.perf_counter()
+        legacy_handle_photo(data, save_dir, label)
+        timings.append(time.perf_counter() - start)
+        app.processEvents()
+    monitor.timer.stop()
+    return timings, monitor.max_gap
+
+
+def run_pipeline(app, photos, save_dir, label):
+    receiver = PhotoReceiver(save_dir, lambda *args: (True, 'Valid'))
+    loop = QEventLoop()
+    timings = []
+
+    def on_saved(filename, size, thumbnail, batch_id):
+        start = time.perf_counter()
+        label.setPixmap(QPixmap.fromImage(thumbnail))
+        timings.append(time.perf_counter() - start)
+        if len(timings) == len(photos):
+            loop.quit()
+
+    receiver.photo_saved.connect(on_saved)
+    monitor = StallMonitor()
+    for data in photos:
+        receiver.receive_photo(data)
+    loop.exec()
+    monitor.timer.stop()
+    return timings, monitor.max_gap
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--photos', type=int, default=5)
+    parser.add_argument('--width', type=int, default=3000)
+    parser.add_argument('--height', type=int, default=2000)
+    args = parser.parse_args()
+
+    app = QApplication.instance() or QApplication([])
+    label = QLabel()
+    save_dir = tempfile.mkdtemp(prefix='photos-')
+
+    raw = make_photo(args.width, args.height)
+    photo = {'photo': base64.b64encode(raw).decode('ascii'), 'mime_type': 'image/jpeg', 'file_size': len(raw)}
+    photos = [photo] * args.photos
+    print(f"{args.photos} photos of {len(raw) / 1024 / 1024:.1f} MB ({args.width}x{args.height})")
+
+    print(f"{'path':>10} {'UI ms/photo':>12} {'max stall ms':>13}")
+    for name, run in (('legacy', run_legacy), ('pipeline', run_pipeline)):
+        timings, max_gap = run(app, photos, save_dir, label)
+        print(f"{name:>10} {sum(timings) / len(timings) * 1000:>12.2f} {max_gap * 1000:>13.1f}")
+
+
+if __name__ == '__main__':
+    main()
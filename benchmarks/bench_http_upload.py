@@ -0,0 +1,175 @@
+"""Server memory taken by concurrent uploads, per transport.
+
+--concurrency phones each send one --size-mb photo at the same time to a
+desktop with delivery acknowledgements and flow control:
+
+    upload_photo    one binary Socket.IO message per photo (the whole
+                    photo is in the server's memory while it is relayed)
+    chunked         upload_begin / upload_chunk... / upload_end
+    http            POST /upload/<session_id> with the photo as the body
+
+The server's peak resident memory (VmHWM) growth and the wall time for
+all uploads to be confirmed are reported. Each transport gets a fresh
+server.
+
+Linux only (reads /proc). Usage: python benchmarks/bench_http_upload.py [--concurrency N] [--size-mb N]
+"""
+import argparse
+import hashlib
+import threading
+import time
+import uuid
+
+import requests
+import socketio
+
+import common
+
+CHUNK_SIZE = 512 * 1024
+
+
+def peak_rss_mb(pid):
+    with open(f'/proc/{pid}/status') as status:
+        for line in status:
+            if line.startswith('VmHWM:'):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+def connect_desktop(url, session_id):
+    """A desktop that acknowledges every payload and confirms every photo"""
+    registered = threading.Event()
+    desktop = common.desktop_client()
+    desktop.on('registration_success', lambda data: registered.set())
+
+    @desktop.on('photo_received')
+    def on_photo(data):
+        if data.get('ack_id') is not None:
+            desktop.emit('desktop_ack', {'session_id': session_id, 'ack_id': data['ack_id']})
+        desktop.emit('photo_stored', {'session_id': session_id, 'upload_id': data.get('upload_id'),
+                                      'status': 'ok', 'filename': 'photo.jpg'})
+
+    @desktop.on('photo_chunk')
+    def on_chunk(data):
+        if data.get('ack_id') is not None:
+            desktop.emit('desktop_ack', {'session_id': session_id, 'ack_id': data['ack_id']})
+
+    @desktop.on('photo_end')
+    def on_end(data):
+        desktop.emit('photo_stored', {'session_id': session_id, 'upload_id': data['upload_id'],
+                                      'status': 'ok', 'filename': 'photo.jpg'})
+
+    desktop.connect(url, transports=['websocket'])
+    desktop.emit('register_desktop', {'session_id': session_id, 'delivery_acks': True, 'flow_control': True})
+    if not registered.wait(10):
+        raise RuntimeError('Desktop did not register')
+    return desktop
+
+
+def phone(url, session_id):
+    """A connected phone and an event set once its upload is confirmed"""
+    confirmed = threading.Event()
+    client = socketio.Client()
+    client.on('upload_success', lambda data: confirmed.set())
+    client.on('upload_saved', lambda data: confirmed.set())
+    client.connect(url, transports=['websocket'])
+    client.emit('register_mobile', {'session_id': session_id})
+    return client, confirmed
+
+
+def send_upload_photo(url, session_id, payload):
+    client, confirmed = phone(url, session_id)
+    message = {'session_id': session_id, 'photo': payload, 'mime_type': 'image/jpeg'}
+
+    # The desktop's window fits one photo at a time; the rest are resent
+    @client.on('upload_error')
+    def on_error(data):
+        if data.get('busy'):
+            time.sleep(data['retry_after'] / 1000)
+            client.emit('upload_photo', message)
+
+    client.emit('upload_photo', message)
+    return client, confirmed
+
+
+def send_chunked(url, session_id, payload):
+    client, confirmed = phone(url, session_id)
+    upload_id = uuid.uuid4().hex
+    client.call('upload_begin', {'session_id': session_id, 'upload_id': upload_id, 'mime_type': 'image/jpeg',
+                                 'total_size': len(payload), 'sha256': hashlib.sha256(payload).hexdigest()})
+    seq = offset = 0
+    while offset < len(payload):
+        ack = client.call('upload_chunk', {'upload_id': upload_id, 'seq': seq,
+                                           'data': payload[offset:offset + CHUNK_SIZE]}, timeout=60)
+        if ack['status'] == 'busy':
+            time.sleep(ack['retry_after'] / 1000)
+            continue
+        seq, offset = ack['next_seq'], ack['offset']
+    client.call('upload_end', {'upload_id': upload_id})
+    return client, confirmed
+
+
+def send_http(url, session_id, payload):
+    client, confirmed = phone(url, session_id)
+    response = requests.post(f"{url}/upload/{session_id}", data=payload, headers={'Content-Type': 'image/jpeg'})
+    if response.json()['status'] == 'ok':
+        confirmed.set()
+    return client, confirmed
+
+
+def run(transport, concurrency, payload):
+    port = common.free_port()
+    proc = common.spawn_server(port)
+    url = f"http://127.0.0.1:{port}"
+    try:
+        session_id = str(uuid.uuid4())
+        desktop = connect_desktop(url, session_id)
+        time.sleep(0.5)
+        before = peak_rss_mb(proc.pid)
+
+        results = []
+        start_gate = threading.Barrier(concurrency + 1)
+
+        def work():
+            start_gate.wait()
+            results.append(transport(url, session_id, payload))
+
+        workers = [threading.Thread(target=work) for _ in range(concurrency)]
+        for worker in workers:
+            worker.start()
+        start_gate.wait()
+        start = time.perf_counter()
+        for worker in workers:
+            worker.join()
+        for client, confirmed in results:
+            if not confirmed.wait(60):
+                raise RuntimeError('Timed out waiting for the desktop to confirm')
+        elapsed = time.perf_counter() - start
+
+        after = peak_rss_mb(proc.pid)
+        for client, _ in results:
+            client.disconnect()
+        desktop.disconnect()
+        return after - before, elapsed
+    finally:
+        proc.terminate()
+        proc.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--size-mb', type=int, default=8)
+    args = parser.parse_args()
+
+    common.quiet_logging()
+    payload = common.fake_photo(args.size_mb * 1024 * 1024)
+    print(f"{args.concurrency} concurrent uploads of {args.size_mb} MB")
+    print(f"{'transport':>12} {'RSS growth MB':>14} {'seconds':>8}")
+    for name, transport in (('upload_photo', send_upload_photo), ('chunked', send_chunked), ('http', send_http)):
+        growth, elapsed = run(transport, args.concurrency, payload)
+        print(f"{name:>12} {growth:>14.0f} {elapsed:>8.2f}")
+
+
+if __name__ == '__main__':
+    main()
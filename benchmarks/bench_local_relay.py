@@ -0,0 +1,155 @@
+"""Photo round trip through a local relay versus a remote one.
+
+A phone uploads a photo and waits for the desktop to confirm it saved
+it (upload_photo -> photo_received -> photo_stored -> upload_success),
+as with the desktop app's delivery acknowledgements. Both clients talk
+to a relay on this machine:
+
+    local       directly, as in the desktop app's RELAY_MODE=local
+    remote      through a TCP proxy that delays every packet by half of
+                --rtt-ms each way, standing in for a hosted relay
+
+Usage: python benchmarks/bench_local_relay.py [--rtt-ms MS] [--size-kb KB] [--runs N]
+"""
+import argparse
+import heapq
+import socket
+import threading
+import time
+import uuid
+
+import socketio
+
+import common
+
+
+class DelayProxy:
+    """TCP proxy that forwards data after a fixed one-way delay"""
+
+    def __init__(self, target_port, delay):
+        self.target_port = target_port
+        self.delay = delay
+        self.listener = socket.create_server(('127.0.0.1', 0))
+        self.port = self.listener.getsockname()[1]
+        threading.Thread(target=self.accept, daemon=True).start()
+
+    def accept(self):
+        while True:
+            client, _ = self.listener.accept()
+            upstream = socket.create_connection(('127.0.0.1', self.target_port))
+            for source, sink in ((client, upstream), (upstream, client)):
+                self.pipe(source, sink)
+
+    def pipe(self, source, sink):
+        """Read from source and write to sink delay seconds later, keeping order"""
+        queue = []
+        ready = threading.Condition()
+        counter = iter(range(1 << 62))
+
+        def read():
+            while True:
+                try:
+                    data = source.recv(65536)
+                except OSError:
+                    data = b''
+                with ready:
+                    heapq.heappush(queue, (time.monotonic() + self.delay, next(counter), data))
+                    ready.notify()
+                if not data:
+                    return
+
+        def write():
+            while True:
+                with ready:
+                    while not queue:
+                        ready.wait()
+                    due, _, data = queue[0]
+                    wait = due - time.monotonic()
+                    if wait > 0:
+                        ready.wait(wait)
+                        continue
+                    heapq.heappop(queue)
+                try:
+                    if not data:
+                        sink.shutdown(socket.SHUT_WR)
+                        return
+                    sink.sendall(data)
+                except OSError:
+                    return
+
+        threading.Thread(target=read, daemon=True).start()
+        threading.Thread(target=write, daemon=True).start()
+
+
+def round_trips(url, payload, runs):
+    """Milliseconds from phone emit to the desktop's confirmation, per photo"""
+    session_id = str(uuid.uuid4())
+    registered = threading.Event()
+    confirmed = threading.Event()
+    errors = []
+
+    desktop = common.desktop_client()
+    desktop.on('registration_success', lambda data: registered.set())
+
+    @desktop.on('photo_received')
+    def on_photo(data):
+        desktop.emit('photo_stored', {'session_id': session_id, 'upload_id': data.get('upload_id'),
+                                      'status': 'ok', 'filename': 'photo.jpg'})
+
+    desktop.connect(url, transports=['websocket'])
+    desktop.emit('register_desktop', {'session_id': session_id, 'delivery_acks': True})
+    if not registered.wait(10):
+        raise RuntimeError('Desktop did not register')
+
+    phone = socketio.Client()
+    phone.on('upload_success', lambda data: confirmed.set())
+
+    @phone.on('upload_error')
+    def on_error(data):
+        errors.append(data.get('message'))
+        confirmed.set()
+
+    phone.connect(url, transports=['websocket'])
+
+    timings = []
+    for _ in range(runs):
+        confirmed.clear()
+        start = time.perf_counter()
+        phone.emit('upload_photo', {'session_id': session_id, 'photo': payload, 'mime_type': 'image/jpeg'})
+        if not confirmed.wait(30):
+            raise RuntimeError('Timed out waiting for the desktop to confirm')
+        if errors:
+            raise RuntimeError(f"Upload rejected: {errors[0]}")
+        timings.append((time.perf_counter() - start) * 1000)
+
+    phone.disconnect()
+    desktop.disconnect()
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rtt-ms', type=float, default=120)
+    parser.add_argument('--size-kb', type=int, default=256)
+    parser.add_argument('--runs', type=int, default=20)
+    args = parser.parse_args()
+
+    common.quiet_logging()
+    port = common.free_port()
+    proc = common.spawn_server(port)
+    try:
+        proxy = DelayProxy(port, args.rtt_ms / 2000)
+        payload = common.fake_photo(args.size_kb * 1024)
+
+        print(f"{args.runs} photos of {args.size_kb} KB, remote stand-in RTT {args.rtt_ms:g} ms")
+        print(f"{'relay':>8} {'p50 ms':>9} {'p95 ms':>9}")
+        for name, relay_port in (('local', port), ('remote', proxy.port)):
+            timings = round_trips(f"http://127.0.0.1:{relay_port}", payload, args.runs)
+            print(f"{name:>8} {common.percentile(timings, 50):>9.1f} {common.percentile(timings, 95):>9.1f}")
+    finally:
+        proc.terminate()
+        proc.wait()
+
+
+if __name__ == '__main__':
+    main()
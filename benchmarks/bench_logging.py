@@ -0,0 +1,105 @@
+"""Relay throughput with different logging setups.
+
+Each configuration runs the relay in its own process (log output goes to
+/dev/null, so only the cost of producing it is measured) and relays the
+same photos from a simulated phone to a desktop, over both upload paths:
+
+    base64      legacy upload_photo with a base64 string, one at a time
+    chunked     binary upload_begin / upload_chunk / upload_end, pipelined
+
+Configurations:
+
+    packet traces   SOCKETIO_PACKET_LOGGING=1 (the old logger=True,
+                    engineio_logger=True setup; traces text payloads)
+    events          every per-upload event, text
+    events json     every per-upload event, JSON
+    sampled 1%      LOG_SAMPLE_RATE=0.01, JSON
+    off             LOG_LEVEL=WARNING
+
+Usage: python benchmarks/bench_logging.py [--photos N] [--size-kb KB]
+"""
+import argparse
+import base64
+import threading
+import uuid
+
+import common
+from bench_batch_upload import run_batch
+
+CONFIGS = [
+    ('packet traces', {'SOCKETIO_PACKET_LOGGING': '1', 'LOG_FORMAT': 'text'}),
+    ('events', {'LOG_FORMAT': 'text'}),
+    ('events json', {'LOG_FORMAT': 'json'}),
+    ('sampled 1%', {'LOG_FORMAT': 'json', 'LOG_SAMPLE_RATE': '0.01'}),
+    ('off', {'LOG_LEVEL': 'WARNING'}),
+]
+
+
+def run_base64(url, photos, payload):
+    """Relay photos one at a time over the legacy base64 path; returns photos/s"""
+    import time
+    import socketio
+
+    session_id = str(uuid.uuid4())
+    encoded = base64.b64encode(payload).decode('ascii')
+    received = threading.Semaphore(0)
+    acked = threading.Semaphore(0)
+
+    desktop = common.desktop_client()
+    registered = threading.Event()
+    desktop.on('registration_success', lambda data: registered.set())
+    desktop.on('photo_received', lambda data: received.release())
+    desktop.connect(url, transports=['websocket'])
+    desktop.emit('register_desktop', {'session_id': session_id})
+    registered.wait(10)
+
+    phone = socketio.Client()
+    phone.on('upload_success', lambda data: acked.release())
+    phone.connect(url, transports=['websocket'])
+
+    start = time.perf_counter()
+    for _ in range(photos):
+        phone.emit('upload_photo', {
+            'session_id': session_id,
+            'photo': encoded,
+            'mime_type': 'image/jpeg',
+            'file_size': len(payload)
+        })
+        if not (acked.acquire(timeout=60) and received.acquire(timeout=60)):
+            raise RuntimeError('Photo was not relayed')
+    elapsed = time.perf_counter() - start
+
+    phone.disconnect()
+    desktop.disconnect()
+    return photos / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--photos', type=int, default=40)
+    parser.add_argument('--size-kb', type=int, default=2048)
+    parser.add_argument('--in-flight', type=int, default=3)
+    args = parser.parse_args()
+
+    common.quiet_logging()
+    payload = common.fake_photo(args.size_kb * 1024)
+    base_env = {'SOCKETIO_PACKET_LOGGING': '', 'LOG_LEVEL': 'INFO', 'LOG_SAMPLE_RATE': '1.0'}
+
+    print(f"{args.photos} photos of {args.size_kb} KB (chunked: {args.in_flight} in flight)")
+    print(f"{'logging':>14} {'base64 photos/s':>16} {'chunked photos/s':>17}")
+    for name, env in CONFIGS:
+        port = common.free_port()
+        proc = common.spawn_server(port, env={**base_env, **env}, quiet=False)
+        try:
+            url = f"http://127.0.0.1:{port}"
+            run_batch(url, 2, payload, 1)  # warm up
+            legacy = run_base64(url, args.photos, payload)
+            chunked = run_batch(url, args.photos, payload, args.in_flight)
+        finally:
+            proc.terminate()
+            proc.wait()
+        print(f"{name:>14} {legacy:>16.1f} {chunked:>17.1f}")
+
+
+if __name__ == '__main__':
+    main()
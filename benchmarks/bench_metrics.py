@@ -0,0 +1,169 @@
+"""Cost of metric updates from many threads.
+
+Each upload records a counter increment and a histogram sample, as the
+relay's handlers do. Two threading models are measured:
+
+    long-lived      --threads threads each record --updates uploads
+    per event       every upload runs in a new thread, at most --threads
+                    at a time, as Flask-SocketIO runs each event and
+                    request in threading mode
+
+relay_metrics (a lock per metric) is compared with one lock around
+all values and with per-thread shards summed when scraped, then a
+scrape is timed. Per-event figures include starting the thread; the
+'no metrics' row is that cost alone.
+
+Usage: python benchmarks/bench_metrics.py [--threads N] [--updates N] [--events N]
+"""
+import argparse
+import random
+import threading
+import time
+
+import common  # noqa: F401  (puts the repo root on sys.path)
+
+from relay_metrics import Metrics, SIZE_BUCKETS
+
+
+def bucket_counts(counts, value):
+    for i, bound in enumerate(SIZE_BUCKETS):
+        if value <= bound:
+            counts[i] += 1
+            break
+    else:
+        counts[len(SIZE_BUCKETS)] += 1
+    counts[-1] += value
+
+
+class NoMetrics:
+    def inc(self, name, value=1, **labels):
+        pass
+
+    def observe(self, name, value, **labels):
+        pass
+
+
+class LockedMetrics:
+    """Shared values behind one lock, kept here for comparison"""
+
+    def __init__(self):
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            bucket_counts(self._values.setdefault(key, [0] * (len(SIZE_BUCKETS) + 2)), value)
+
+
+class ShardedMetrics:
+    """A dict per thread, registered under a lock on first use, kept here for comparison"""
+
+    def __init__(self):
+        self._local = threading.local()
+        self._shards = []
+        self._lock = threading.Lock()
+
+    def _shard(self):
+        try:
+            return self._local.shard
+        except AttributeError:
+            shard = self._local.shard = {}
+            with self._lock:
+                self._shards.append(shard)
+            return shard
+
+    def inc(self, name, value=1, **labels):
+        shard = self._shard()
+        key = (name, tuple(sorted(labels.items())))
+        shard[key] = shard.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        shard = self._shard()
+        key = (name, tuple(sorted(labels.items())))
+        bucket_counts(shard.setdefault(key, [0] * (len(SIZE_BUCKETS) + 2)), value)
+
+
+def relay_metrics():
+    metrics = Metrics()
+    metrics.counter('relay_uploads_total', 'Uploads by outcome')
+    metrics.histogram('relay_payload_size_bytes', 'Size of relayed photos', SIZE_BUCKETS)
+    return metrics
+
+
+SIZES = [random.randint(10_000, 10_000_000) for _ in range(1000)]
+
+
+def record(metrics, i):
+    metrics.inc('relay_uploads_total', outcome='relayed')
+    metrics.observe('relay_payload_size_bytes', SIZES[i % len(SIZES)])
+
+
+def long_lived(metrics, threads, updates):
+    """ns per upload, each of threads recording updates uploads"""
+    start_gate = threading.Barrier(threads + 1)
+
+    def work():
+        start_gate.wait()
+        for i in range(updates):
+            record(metrics, i)
+
+    workers = [threading.Thread(target=work) for _ in range(threads)]
+    for worker in workers:
+        worker.start()
+    start_gate.wait()
+    start = time.perf_counter()
+    for worker in workers:
+        worker.join()
+    return (time.perf_counter() - start) / (threads * updates) * 1e9
+
+
+def per_event(metrics, threads, events):
+    """us per upload, each recorded by a new thread, at most threads at a time"""
+    slots = threading.Semaphore(threads)
+
+    def work(i):
+        try:
+            record(metrics, i)
+        finally:
+            slots.release()
+
+    start = time.perf_counter()
+    for i in range(events):
+        slots.acquire()
+        threading.Thread(target=work, args=(i,)).start()
+    for _ in range(threads):
+        slots.acquire()
+    return (time.perf_counter() - start) / events * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--updates', type=int, default=50_000)
+    parser.add_argument('--events', type=int, default=20_000)
+    args = parser.parse_args()
+
+    variants = (('no metrics', NoMetrics), ('one lock', LockedMetrics),
+                ('per-thread shards', ShardedMetrics), ('lock per metric', relay_metrics))
+    print(f"{args.threads} threads; {args.updates:,} uploads each (long-lived), "
+          f"{args.events:,} thread-per-upload events")
+    print(f"{'metrics':>18} {'long-lived ns':>14} {'per event us':>13}")
+    for name, factory in variants:
+        print(f"{name:>18} {long_lived(factory(), args.threads, args.updates):>14.0f} "
+              f"{per_event(factory(), args.threads, args.events):>13.1f}")
+
+    metrics = relay_metrics()
+    long_lived(metrics, args.threads, args.updates // 10)
+    start = time.perf_counter()
+    text = metrics.render()
+    print(f"scrape: {(time.perf_counter() - start) * 1e3:.2f} ms, {len(text.splitlines())} lines")
+
+
+if __name__ == '__main__':
+    main()
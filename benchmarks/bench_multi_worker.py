@@ -0,0 +1,77 @@
+"""Cross-worker relay: desktop on worker A, phone on worker B.
+
+Starts two server processes sharing a SQLite session store and kombu's
+filesystem message queue (no broker needed), then checks that uploads to
+worker B reach the desktop on worker A and reports the relay latency.
+
+Usage: python benchmarks/bench_multi_worker.py [--runs N] [--size-kb KB]
+"""
+import argparse
+import os
+import tempfile
+import threading
+import time
+import uuid
+
+import common
+
+import socketio
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--runs', type=int, default=20)
+    parser.add_argument('--size-kb', type=int, default=256)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='relay-')
+    env = {
+        'SESSION_STORE_URL': f"sqlite:///{os.path.join(workdir, 'sessions.db')}",
+        'SOCKETIO_MESSAGE_QUEUE': f"filesystem:///{os.path.join(workdir, 'queue')}",
+    }
+    port_a, port_b = common.free_port(), common.free_port()
+    workers = [common.spawn_server(port_a, env), common.spawn_server(port_b, env)]
+
+    try:
+        session_id = str(uuid.uuid4())
+        received = threading.Event()
+        registered = threading.Event()
+
+        desktop = socketio.Client()
+        desktop.on('registration_success', lambda data: registered.set())
+        desktop.on('photo_received', lambda data: received.set())
+        desktop.connect(f"http://127.0.0.1:{port_a}", transports=['websocket'])
+        desktop.emit('register_desktop', {'session_id': session_id})
+        if not registered.wait(10):
+            raise RuntimeError('Desktop registration timed out')
+
+        phone = socketio.Client()
+        phone.connect(f"http://127.0.0.1:{port_b}", transports=['websocket'])
+
+        payload = common.fake_photo(args.size_kb * 1024)
+        timings = []
+        for _ in range(args.runs):
+            received.clear()
+            start = time.perf_counter()
+            phone.emit('upload_photo', {
+                'session_id': session_id,
+                'photo': payload,
+                'mime_type': 'image/jpeg',
+                'file_size': len(payload),
+            })
+            if not received.wait(30):
+                raise RuntimeError('Photo was not delivered across workers')
+            timings.append((time.perf_counter() - start) * 1000)
+
+        phone.disconnect()
+        desktop.disconnect()
+        print(f"delivered {len(timings)}/{args.runs} uploads from worker B to worker A")
+        print(f"p50={common.percentile(timings, 50):.1f}ms p99={common.percentile(timings, 99):.1f}ms")
+    finally:
+        for worker in workers:
+            worker.terminate()
+            worker.wait()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+"""Server memory taken by oversized uploads.
+
+A client sends one oversized upload_photo message (--size-mb of base64)
+over a raw WebSocket, --repeat times. The server's peak resident memory
+(VmHWM) is compared before and after, with the default MAX_MESSAGE_SIZE
+and with the limit for chunk-only deployments. A chunked upload that
+declares the same size is also timed; upload_begin turns it down before
+any photo data is sent.
+
+Linux only (reads /proc). Usage: python benchmarks/bench_oversize.py [--size-mb N]
+"""
+import argparse
+import time
+
+import socketio
+import websocket
+
+import common
+
+CHUNK_ONLY_LIMIT = 1_100_000
+
+
+def peak_rss_mb(pid):
+    with open(f'/proc/{pid}/status') as status:
+        for line in status:
+            if line.startswith('VmHWM:'):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+def send_oversized(port, size_mb):
+    """Send one huge message and wait (briefly) for the server to hang up"""
+    ws = websocket.create_connection(
+        f"ws://127.0.0.1:{port}/socket.io/?EIO=4&transport=websocket", timeout=5)
+    ws.recv()  # Engine.IO open packet
+    ws.send('40')
+    ws.recv()  # Socket.IO connect
+    message = '42["upload_photo",{"session_id":"bench","photo":"' + 'A' * (size_mb * 1024 * 1024) + '"}]'
+    try:
+        ws.send(message)
+        while ws.recv():
+            pass
+    except (websocket.WebSocketException, OSError):
+        pass
+    finally:
+        ws.close()
+
+
+def preflight_rejection_ms(port, size_mb):
+    """Time for upload_begin to turn down an oversized chunked upload"""
+    phone = socketio.Client()
+    phone.connect(f"http://127.0.0.1:{port}", transports=['websocket'])
+    start = time.perf_counter()
+    phone.call('upload_begin', {'session_id': 'bench', 'upload_id': 'oversized',
+                                'total_size': size_mb * 1024 * 1024, 'mime_type': 'image/jpeg'})
+    elapsed = (time.perf_counter() - start) * 1e3
+    phone.disconnect()
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--size-mb', type=int, default=50)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    common.quiet_logging()
+    print(f"{args.repeat} x {args.size_mb} MB upload_photo messages")
+    print(f"{'MAX_MESSAGE_SIZE':>18} {'peak RSS MB':>12} {'growth MB':>10}")
+    for limit in (None, CHUNK_ONLY_LIMIT):
+        port = common.free_port()
+        proc = common.spawn_server(port, env={'MAX_MESSAGE_SIZE': str(limit)} if limit else None)
+        try:
+            before = peak_rss_mb(proc.pid)
+            for _ in range(args.repeat):
+                send_oversized(port, args.size_mb)
+            time.sleep(0.5)
+            after = peak_rss_mb(proc.pid)
+            if limit is None:
+                preflight = preflight_rejection_ms(port, args.size_mb)
+        finally:
+            proc.terminate()
+            proc.wait()
+        label = f"{limit:,}" if limit else 'default'
+        print(f"{label:>18} {after:>12.0f} {after - before:>10.0f}")
+    print(f"chunked upload of {args.size_mb} MB turned down by upload_begin in {preflight:.1f} ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+"""Preview conversion cost: PNG round-trip vs direct QImage wrapping.
+
+The old path converted to RGB, thumbnailed, re-encoded as PNG and decoded
+the PNG again with QImage.fromData. make_thumbnail() lets the JPEG decoder
+scale down with Image.draft() and wraps the Pillow buffer directly.
+
+Usage: QT_QPA_PLATFORM=offscreen python benchmarks/bench_preview.py [--runs N]
+"""
+import argparse
+import io
+import os
+import tempfile
+import time
+
+import common  # noqa: F401  (puts the repo root on sys.path)
+
+import qrcode
+from PIL import Image
+from PySide6.QtGui import QImage, QGuiApplication
+
+from GUI import make_thumbnail, pil_to_qimage
+
+
+def png_round_trip(img):
+    buf = io.BytesIO()
+    img.save(buf, format='PNG')
+    return QImage.fromData(buf.getvalue())
+
+
+def legacy_thumbnail(path, size=(400, 300)):
+    img = Image.open(path)
+    if img.mode != 'RGB':
+        img = img.convert('RGB')
+    img.thumbnail(size, Image.Resampling.LANCZOS)
+    return png_round_trip(img)
+
+
+def make_photo(path, width, height):
+    """A smooth gradient with noise, saved as a camera-like JPEG"""
+    img = Image.linear_gradient('L').resize((width, height)).convert('RGB')
+    noise = Image.effect_noise((width, height), 40).convert('RGB')
+    Image.blend(img, noise, 0.15).save(path, format='JPEG', quality=90)
+
+
+def best_of(fn, runs):
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return min(timings) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--width', type=int, default=4000)
+    parser.add_argument('--height', type=int, default=3000)
+    args = parser.parse_args()
+
+    app = QGuiApplication.instance() or QGuiApplication([])  # noqa: F841
+
+    path = os.path.join(tempfile.mkdtemp(prefix='preview-'), 'photo.jpg')
+    make_photo(path, args.width, args.height)
+    print(f"photo: {args.width}x{args.height}, {os.path.getsize(path) / 1024 / 1024:.1f} MB JPEG")
+
+    qr = qrcode.QRCode(version=1, box_size=10, border=4)
+    qr.add_data('https://example.com/upload?session=00000000-0000-0000-0000-000000000000')
+    qr.make(fit=True)
+    qr_img = qr.make_image(fill_color="black", back_color="white").resize((280, 280))
+
+    cases = (
+        ('thumbnail', lambda: legacy_thumbnail(path), lambda: make_thumbnail(path)),
+        ('qr code', lambda: png_round_trip(qr_img), lambda: pil_to_qimage(qr_img.convert('L'))),
+    )
+    print(f"{'case':>10} {'png round-trip ms':>18} {'direct ms':>10} {'speedup':>8}")
+    for name, old, new in cases:
+        old_ms = best_of(old, args.runs)
+        new_ms = best_of(new, args.runs)
+        print(f"{name:>10} {old_ms:>18.2f} {new_ms:>10.2f} {old_ms / new_ms:>7.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+"""CPU time and peak memory of preview decoding for large photos.
+
+Each measurement runs in a fresh process so peak RSS is not shared between
+cases (peak RSS is reset through /proc/self/clear_refs, so Linux only).
+
+    full     - decode at full resolution, then thumbnail
+    previous - the old update_preview (convert to RGB, then thumbnail;
+               Pillow's thumbnail() already drafted RGB JPEGs)
+    reduced  - GUI.decode_preview()
+
+Usage: python benchmarks/bench_preview_decode.py [--megapixels N]
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import common  # noqa: F401  (puts the repo root on sys.path)
+
+from PIL import Image
+
+FORMATS = (('JPEG', 'jpg'), ('WEBP', 'webp'), ('PNG', 'png'))
+METHODS = ('full', 'previous', 'reduced')
+
+
+def rss_kb(field):
+    """Read VmRSS / VmHWM from /proc/self/status"""
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith(field + ':'):
+                return int(line.split()[1])
+    return 0
+
+
+def make_photo(path, fmt, width, height):
+    """A smooth gradient with noise, roughly like a camera shot"""
+    img = Image.linear_gradient('L').resize((width, height)).convert('RGB')
+    noise = Image.effect_noise((width, height), 40).convert('RGB')
+    Image.blend(img, noise, 0.15).save(path, format=fmt, quality=90)
+
+
+def measure(method, path):
+    """Child process: decode once and report CPU ms and peak RSS growth"""
+    from GUI import decode_preview
+
+    with open('/proc/self/clear_refs', 'w') as f:
+        f.write('5')  # reset the peak RSS watermark
+    before = rss_kb('VmRSS')
+    start = time.process_time()
+    if method == 'full':
+        img = Image.open(path)
+        img.load()
+        img.thumbnail((400, 300), Image.Resampling.LANCZOS)
+    elif method == 'previous':
+        img = Image.open(path)
+        if img.mode != 'RGB':
+            img = img.convert('RGB')
+        img.thumbnail((400, 300), Image.Resampling.LANCZOS)
+    else:
+        decode_preview(path, (400, 300))
+    cpu_ms = (time.process_time() - start) * 1000
+    peak_kb = rss_kb('VmHWM') - before
+    print(json.dumps({'cpu_ms': cpu_ms, 'peak_mb': peak_kb / 1024}))
+
+
+def run_child(method, path):
+    out = subprocess.run([sys.executable, __file__, '--child', method, path],
+                         capture_output=True, text=True, check=True,
+                         cwd=os.path.dirname(os.path.abspath(__file__)))
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--megapixels', type=int, default=24)
+    parser.add_argument('--child', nargs=2, metavar=('METHOD', 'PATH'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        measure(*args.child)
+        return
+
+    height = int((args.megapixels * 1_000_000 * 3 / 4) ** 0.5)
+    width = height * 4 // 3
+    workdir = tempfile.mkdtemp(prefix='preview-')
+    print(f"{width}x{height} ({args.megapixels} MP) -> 400x300 preview")
+    print(f"{'format':>6} {'method':>9} {'cpu ms':>8} {'peak MB':>8}")
+    for fmt, ext in FORMATS:
+        path = os.path.join(workdir, f"photo.{ext}")
+        make_photo(path, fmt, width, height)
+        for method in METHODS:
+            result = run_child(method, path)
+            print(f"{fmt:>6} {method:>9} {result['cpu_ms']:>8.1f} {result['peak_mb']:>8.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+"""Disconnect cleanup cost with many live sessions.
+
+Compares the previous full-dict scan against MemorySessionStore's reverse
+index. Each phone disconnect (owns no session) and each desktop disconnect
+is timed against a store holding --sessions live sessions.
+
+Usage: python benchmarks/bench_session_store.py [--sessions N] [--disconnects N]
+"""
+import argparse
+import time
+import uuid
+
+import common  # noqa: F401  (puts the repo root on sys.path)
+
+from backends import MemorySessionStore
+
+
+class LinearScanStore:
+    """The original dict-plus-scan approach, kept here for comparison"""
+
+    def __init__(self):
+        self._sessions = {}
+
+    def register(self, session_id, sid):
+        self._sessions[session_id] = sid
+
+    def remove_sid(self, sid):
+        removed = [session_id for session_id, desktop_sid in self._sessions.items() if desktop_sid == sid]
+        for session_id in removed:
+            del self._sessions[session_id]
+        return removed
+
+
+def run(store, sessions, disconnects):
+    pairs = [(str(uuid.uuid4()), uuid.uuid4().hex) for _ in range(sessions)]
+
+    start = time.perf_counter()
+    for session_id, sid in pairs:
+        store.register(session_id, sid)
+    register_us = (time.perf_counter() - start) / sessions * 1e6
+
+    start = time.perf_counter()
+    for _ in range(disconnects):
+        store.remove_sid(uuid.uuid4().hex)  # phone: owns nothing
+    phone_us = (time.perf_counter() - start) / disconnects * 1e6
+
+    start = time.perf_counter()
+    for session_id, sid in pairs[:disconnects]:
+        store.remove_sid(sid)
+    desktop_us = (time.perf_counter() - start) / disconnects * 1e6
+
+    return register_us, phone_us, desktop_us
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sessions', type=int, default=100_000)
+    parser.add_argument('--disconnects', type=int, default=200)
+    args = parser.parse_args()
+
+    print(f"{args.sessions:,} sessions, {args.disconnects} disconnects of each kind")
+    print(f"{'store':>18} {'register us':>12} {'phone disc us':>14} {'desktop disc us':>16}")
+    for name, store in (('linear scan', LinearScanStore()), ('reverse index', MemorySessionStore())):
+        register_us, phone_us, desktop_us = run(store, args.sessions, args.disconnects)
+        print(f"{name:>18} {register_us:>12.2f} {phone_us:>14.2f} {desktop_us:>16.2f}")
+
+
+if __name__ == '__main__':
+    main()
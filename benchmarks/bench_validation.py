@@ -0,0 +1,52 @@
+"""Cost of validating a legacy base64 upload.
+
+Times the server's validation (real size from the string length, magic
+bytes from the first few decoded bytes) against decoding the whole
+string, for payloads of several sizes.
+
+Usage: python benchmarks/bench_validation.py [--repeat N]
+"""
+import argparse
+import base64
+import time
+
+import common  # noqa: F401  (puts the repo root on sys.path)
+
+common.quiet_logging()
+from server import inspect_payload, sniff_image_type  # noqa: E402
+
+SIZES_KB = (64, 1024, 4096, 14 * 1024)
+
+
+def per_call_us(func, payload, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func(payload)
+    return (time.perf_counter() - start) / repeat * 1e6
+
+
+def sniff(payload):
+    size, head = inspect_payload(payload)
+    return size, sniff_image_type(head)
+
+
+def full_decode(payload):
+    photo = base64.b64decode(payload)
+    return len(photo), sniff_image_type(photo[:12])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    print(f"{'payload KB':>10} {'sniff us':>10} {'full decode us':>15}")
+    for size_kb in SIZES_KB:
+        payload = base64.b64encode(common.fake_photo(size_kb * 1024)).decode('ascii')
+        assert sniff(payload) == full_decode(payload)
+        print(f"{size_kb:>10} {per_call_us(sniff, payload, args.repeat * 100):>10.2f} "
+              f"{per_call_us(full_decode, payload, args.repeat):>15.0f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+"""Shared helpers for the relay benchmarks.
+
+Run benchmarks from the repository root, e.g.:
+
+    python benchmarks/bench_binary_upload.py
+"""
+import logging
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+# Make server.py importable when running a benchmark as a script
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def free_port():
+    """Return a free TCP port on localhost"""
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def fake_photo(size):
+    """Random bytes behind a JPEG signature, so the relay accepts them as a photo"""
+    return b'\xff\xd8\xff\xe0' + os.urandom(size - 4)
+
+
+def quiet_logging():
+    """Silence per-packet Socket.IO logging so it doesn't skew timings"""
+    for name in ('server', 'socketio', 'socketio.server', 'socketio.client',
+                 'engineio', 'engineio.server', 'engineio.client', 'werkzeug'):
+        logging.getLogger(name).setLevel(logging.CRITICAL)
+
+
+def start_server(port=None, quiet=True):
+    """Start the relay server in a background thread and return its URL"""
+    import server
+    if quiet:
+        quiet_logging()
+    port = port or free_port()
+    thread = threading.Thread(
+        target=server.socketio.run,
+        args=(server.app,),
+        kwargs={'host': '127.0.0.1', 'port': port, 'debug': False,
+                'use_reloader': False, 'log_output': False,
+                'allow_unsafe_werkzeug': True},
+        daemon=True,
+    )
+    thread.start()
+    wait_for_port(port)
+    return f"http://127.0.0.1:{port}"
+
+
+def desktop_client():
+    """Socket.IO client configured like the desktop app's (events in arrival order)"""
+    from GUI import InOrderClient
+    return InOrderClient()
+
+
+def wait_for_port(port, timeout=10):
+    """Block until localhost:port accepts connections"""
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=0.2):
+                return
+        except OSError:
+            time.sleep(0.05)
+    raise RuntimeError(f"Server on port {port} did not start")
+
+
+def spawn_server(port, env=None, quiet=True):
+    """Start the relay server in a separate process and return the Popen.
+    
+    With quiet=False the server logs as configured (output is discarded).
+    """
+    code = (
+        "import threading, common; "
+        f"common.start_server({port}, quiet={quiet}); "
+        "threading.Event().wait()"
+    )
+    proc = subprocess.Popen(
+        [sys.executable, '-c', code],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        env={**os.environ, **(env or {})},
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    wait_for_port(port)
+    return proc
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a list of numbers"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, int(round(pct / 100 * len(ordered))) - 1))
+    return ordered[index]
@@ -0,0 +1,111 @@
+"""Load test: N desktop/phone client pairs relaying photos concurrently.
+
+Starts the relay in-process (threading mode) unless --url points at a
+running server, e.g. one started with the Procfile's gevent worker:
+
+    SOCKETIO_ASYNC_MODE=gevent gunicorn -k geventwebsocket.gunicorn.workers.GeventWebSocketWorker \\
+        -w 1 -b 127.0.0.1:8000 server:app
+    python benchmarks/load_test.py --url http://127.0.0.1:8000 --pairs 50
+
+Reports p50/p99 relay latency (phone emit -> desktop receive) and uploads/s.
+"""
+import argparse
+import threading
+import time
+import uuid
+
+import common
+
+import socketio
+
+
+class ClientPair:
+    """One desktop and one phone sharing a session"""
+
+    def __init__(self, url, payload):
+        self.url = url
+        self.payload = payload
+        self.session_id = str(uuid.uuid4())
+        self.latencies = []
+        self.errors = 0
+        self.received = threading.Event()
+        self.desktop = socketio.Client()
+        self.phone = socketio.Client()
+
+        @self.desktop.on('photo_received')
+        def on_photo(data):
+            self.received.set()
+
+        @self.phone.on('upload_error')
+        def on_error(data):
+            self.errors += 1
+            self.received.set()
+
+    def connect(self):
+        registered = threading.Event()
+        self.desktop.on('registration_success', lambda data: registered.set())
+        self.desktop.connect(self.url, transports=['websocket'])
+        self.desktop.emit('register_desktop', {'session_id': self.session_id})
+        if not registered.wait(10):
+            raise RuntimeError('Desktop registration timed out')
+        self.phone.connect(self.url, transports=['websocket'])
+
+    def run(self, uploads):
+        for _ in range(uploads):
+            self.received.clear()
+            errors = self.errors
+            start = time.perf_counter()
+            self.phone.emit('upload_photo', {
+                'session_id': self.session_id,
+                'photo': self.payload,
+                'mime_type': 'image/jpeg',
+                'file_size': len(self.payload),
+            })
+            if not self.received.wait(60):
+                self.errors += 1
+            elif self.errors == errors:
+                self.latencies.append((time.perf_counter() - start) * 1000)
+
+    def close(self):
+        self.phone.disconnect()
+        self.desktop.disconnect()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', help='Relay server URL (default: start one in-process)')
+    parser.add_argument('--pairs', type=int, default=10, help='Concurrent desktop/phone pairs')
+    parser.add_argument('--uploads', type=int, default=10, help='Uploads per pair')
+    parser.add_argument('--size-kb', type=int, default=512, help='Photo size in KB')
+    args = parser.parse_args()
+
+    common.quiet_logging()
+    url = args.url or common.start_server()
+    payload = common.fake_photo(args.size_kb * 1024)
+
+    pairs = [ClientPair(url, payload) for _ in range(args.pairs)]
+    for pair in pairs:
+        pair.connect()
+
+    threads = [threading.Thread(target=pair.run, args=(args.uploads,)) for pair in pairs]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    for pair in pairs:
+        pair.close()
+
+    latencies = [latency for pair in pairs for latency in pair.latencies]
+    errors = sum(pair.errors for pair in pairs)
+    print(f"pairs={args.pairs} uploads={len(latencies)} errors={errors} size={args.size_kb}KB")
+    print(f"p50={common.percentile(latencies, 50):.1f}ms "
+          f"p99={common.percentile(latencies, 99):.1f}ms "
+          f"throughput={len(latencies) / elapsed:.1f} uploads/s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+"""Logging for the relay server.
+
+Configured from the environment:
+
+    LOG_LEVEL=INFO
+    LOG_FORMAT=text              (or json: one object per line)
+    LOG_SAMPLE_RATE=1.0          fraction of per-upload event logs kept
+    SOCKETIO_PACKET_LOGGING=1    Socket.IO / Engine.IO per-packet traces (debugging only)
+
+Log output never carries photo data: event logs take scalar fields only
+(bytes are replaced by their length), and every line, including packet
+traces, is cut to MAX_MESSAGE_LENGTH characters.
+"""
+import json
+import logging
+import os
+import random
+import sys
+
+MAX_MESSAGE_LENGTH = 300
+MAX_FIELD_LENGTH = 100
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line: ts, level, logger, message and event fields"""
+
+    def format(self, record):
+        entry = {
+            'ts': round(record.created, 3),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage()
+        }
+        entry.update(getattr(record, 'fields', None) or {})
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """The basicConfig layout (LEVEL:logger:message) followed by key=value fields"""
+
+    def __init__(self):
+        super().__init__(logging.BASIC_FORMAT)
+
+    def format(self, record):
+        line = super().format(record)
+        fields = getattr(record, 'fields', None)
+        if fields:
+            line += ' ' + ' '.join(f"{key}={value}" for key, value in fields.items())
+        return line
+
+
+class TruncateFilter(logging.Filter):
+    """Cut long messages (such as packet traces with payloads) to max_length"""
+
+    def __init__(self, max_length=MAX_MESSAGE_LENGTH):
+        super().__init__()
+        self.max_length = max_length
+
+    def filter(self, record):
+        message = record.getMessage()
+        if len(message) > self.max_length:
+            record.msg = f"{message[:self.max_length]}... ({len(message)} chars)"
+            record.args = None
+        return True
+
+
+def scrub(value):
+    """Make an event field safe to log: no payloads, no unbounded strings"""
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return f"<{len(value)} bytes>"
+    if isinstance(value, str) and len(value) > MAX_FIELD_LENGTH:
+        return f"<{len(value)} chars>"
+    return value
+
+
+class EventLogger:
+    """Sampled, structured logging for per-upload events.
+
+    The sampling decision is made before anything is formatted, so dropped
+    events cost one random() call. Warnings and errors should go through
+    the plain logger so they are never sampled away.
+    """
+
+    def __init__(self, logger, sample_rate=1.0):
+        self.logger = logger
+        self.sample_rate = sample_rate
+
+    def event(self, name, level=logging.INFO, **fields):
+        if self.sample_rate < 1.0 and random.random() >= self.sample_rate:
+            return
+        if not self.logger.isEnabledFor(level):
+            return
+        self.logger.log(level, name, extra={'fields': {key: scrub(value) for key, value in fields.items()}})
+
+
+def packet_logging_enabled():
+    """True if the Socket.IO / Engine.IO per-packet loggers should be on"""
+    return os.getenv('SOCKETIO_PACKET_LOGGING', '').lower() in ('1', 'true', 'yes')
+
+
+def configure_logging(stream=None):
+    """Set up the root logger from LOG_LEVEL and LOG_FORMAT"""
+    handler = logging.StreamHandler(stream or sys.stdout)
+    handler.setFormatter(JsonFormatter() if os.getenv('LOG_FORMAT') == 'json' else TextFormatter())
+    handler.addFilter(TruncateFilter())
+
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    root.setLevel(os.getenv('LOG_LEVEL', 'INFO').upper())
+
+
+def event_logger(logger):
+    """EventLogger for logger, sampled at LOG_SAMPLE_RATE"""
+    return EventLogger(logger, sample_rate=float(os.getenv('LOG_SAMPLE_RATE', 1.0)))
@@ -0,0 +1,130 @@
+"""Prometheus-style metrics for the relay server.
+
+Each counter and histogram keeps its values in a dict behind its own
+lock, so updates to different metrics never wait on each other and an
+update holds its lock for one dict operation. (In threading mode
+Flask-SocketIO runs every event and request in a new thread, so
+per-thread storage would mostly be set up and folded away again; see
+benchmarks/bench_metrics.py.) Under gevent or eventlet the locks are
+uncontended.
+
+Gauges are read when scraped, from callbacks the server registers.
+"""
+import math
+import threading
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Histogram buckets (upper bounds) for byte sizes and durations
+SIZE_BUCKETS = (16 * 1024, 64 * 1024, 256 * 1024, 1024 ** 2, 2 * 1024 ** 2,
+                4 * 1024 ** 2, 8 * 1024 ** 2, 16 * 1024 ** 2)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+               for _, value in labels)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(labels, escaped)) + '}'
+
+
+def format_value(value):
+    if isinstance(value, float):
+        if math.isinf(value):
+            return '+Inf' if value > 0 else '-Inf'
+        return repr(value)
+    return str(value)
+
+
+class Metrics:
+    """Counters, histograms and gauges rendered in the Prometheus text format"""
+
+    def __init__(self):
+        self._families = {}  # {name: (type, help, buckets)}, in registration order
+        self._gauges = {}  # {name: callback}
+        self._values = {}  # {name: {labels: value or bucket counts}}
+        self._locks = {}  # {name: lock guarding its values}
+
+    def counter(self, name, help_text):
+        """Register a counter; by convention its name ends in _total"""
+        self._families[name] = ('counter', help_text, None)
+        self._values[name] = {}
+        self._locks[name] = threading.Lock()
+
+    def histogram(self, name, help_text, buckets):
+        self._families[name] = ('histogram', help_text, tuple(buckets))
+        self._values[name] = {}
+        self._locks[name] = threading.Lock()
+
+    def gauge(self, name, help_text, callback, kind='gauge'):
+        """Register a value read from callback when scraped.
+
+        callback returns a number, or {labels: number} with labels a tuple
+        of (name, value) pairs. kind='counter' exports a running total kept
+        elsewhere (such as a store's own counters).
+        """
+        self._families[name] = (kind, help_text, None)
+        self._gauges[name] = callback
+
+    def inc(self, name, value=1, **labels):
+        """Add to a counter"""
+        key = tuple(sorted(labels.items()))
+        values = self._values[name]
+        with self._locks[name]:
+            values[key] = values.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        """Record one histogram sample"""
+        buckets = self._families[name][2]
+        key = tuple(sorted(labels.items()))
+        for index, bound in enumerate(buckets):
+            if value <= bound:
+                break
+        else:
+            index = len(buckets)
+        values = self._values[name]
+        with self._locks[name]:
+            counts = values.get(key)
+            if counts is None:
+                counts = values[key] = [0] * (len(buckets) + 2)  # buckets, +Inf, sum
+            counts[index] += 1
+            counts[-1] += value
+
+    def collect(self):
+        """Current values: {(name, labels): value or bucket counts}"""
+        totals = {}
+        for name, values in self._values.items():
+            with self._locks[name]:
+                for labels, value in values.items():
+                    totals[(name, labels)] = list(value) if isinstance(value, list) else value
+        return totals
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format"""
+        totals = self.collect()
+        by_name = {}
+        for (name, labels), value in totals.items():
+            by_name.setdefault(name, []).append((labels, value))
+
+        lines = []
+        for name, (kind, help_text, buckets) in self._families.items():
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+            if name in self._gauges:
+                value = self._gauges[name]()
+                samples = value.items() if isinstance(value, dict) else [((), value)]
+                for labels, sample in samples:
+                    lines.append(f'{name}{format_labels(labels)} {format_value(sample)}')
+            elif kind == 'counter':
+                for labels, value in sorted(by_name.get(name, [])):
+                    lines.append(f'{name}{format_labels(labels)} {format_value(value)}')
+            else:
+                for labels, counts in sorted(by_name.get(name, [])):
+                    cumulative = 0
+                    for bound, count in zip(buckets + (math.inf,), counts):
+                        cumulative += count
+                        le = labels + (('le', format_value(float(bound))),)
+                        lines.append(f'{name}_bucket{format_labels(le)} {cumulative}')
+                    lines.append(f'{name}_sum{format_labels(labels)} {format_value(counts[-1])}')
+                    lines.append(f'{name}_count{format_labels(labels)} {cumulative}')
+        return '\n'.join(lines) + '\n'
@@ -1,31 +1,610 @@
-from flask import Flask, render_template, request, jsonify
+import os
+
+# Async workers need the standard library patched before anything else is
+# imported. Set SOCKETIO_ASYNC_MODE to 'gevent' or 'eventlet' in the process
+# environment (it is read before .env is loaded); unset keeps threading mode.
+ASYNC_MODE = os.getenv('SOCKETIO_ASYNC_MODE') or 'threading'
+if ASYNC_MODE == 'gevent':
+    from gevent import monkey
+    monkey.patch_all()
+elif ASYNC_MODE == 'eventlet':
+    import eventlet
+    eventlet.monkey_patch()
+
+from flask import Flask, Response, render_template, request, jsonify
 from flask_socketio import SocketIO, emit, join_room
 from flask_cors import CORS
-import os
+from backends import create_session_store, create_client_manager, create_spool
+from relay_logging import configure_logging, event_logger, packet_logging_enabled
+from relay_metrics import Metrics, CONTENT_TYPE, SIZE_BUCKETS, LATENCY_BUCKETS
+from werkzeug.exceptions import ClientDisconnected, RequestEntityTooLarge
+from werkzeug.sansio.multipart import MultipartDecoder, File, Data, Epilogue, NeedData
 import logging
+import base64
+import functools
+import hashlib
+import io
+import itertools
+import re
+import socket
+import threading
+import time
+import uuid
 from dotenv import load_dotenv
 import sys
 
 # Load environment variables
 load_dotenv()
 
-# Configure logging
-logging.basicConfig(level=logging.INFO, stream=sys.stdout)
+# Configure logging (LOG_LEVEL, LOG_FORMAT, LOG_SAMPLE_RATE; see relay_logging.py)
+configure_logging(sys.stdout)
 logger = logging.getLogger(__name__)
 
+# Per-upload logs go through here so they can be sampled under load
+events = event_logger(logger)
+
 app = Flask(__name__)
 app.config['SECRET_KEY'] = os.getenv('SECRET_KEY')
-app.config['MAX_CONTENT_LENGTH'] = 10 * 1024 * 1024  # 10MB max file size
+app.config['MAX_CONTENT_LENGTH'] = 10 * 1024 * 1024 + 64 * 1024  # 10MB max file size, plus multipart headers
 
 CORS(app, resources={r"/*": {"origins": "*"}})
-# socketio = SocketIO(app, cors_allowed_origins="*", async_mode='eventlet', logger=True, engineio_logger=True) # for high concurrency/traffic
-socketio = SocketIO( app, cors_allowed_origins="*", logger=True, engineio_logger=True, 
-                    max_http_buffer_size=15 * 1024 * 1024,  # 15MB max payload size
-                    ping_timeout=60,ping_interval=25
+
+# Largest Socket.IO message accepted. The default fits a legacy upload_photo
+# (a whole 10MB photo as base64); current phones send chunks of at most
+# MAX_CHUNK_SIZE, so deployments without legacy clients can set it to about
+# 1100000 and have anything bigger dropped at that point.
+MAX_MESSAGE_SIZE = int(os.getenv('MAX_MESSAGE_SIZE', (10 * 1024 * 1024 + 2) // 3 * 4 + 64 * 1024))
+
+# Set SOCKETIO_MESSAGE_QUEUE to run several workers/instances (see backends.py)
+# Per-packet Socket.IO logging writes every payload; it is for debugging only
+socketio = SocketIO( app, cors_allowed_origins="*", async_mode=ASYNC_MODE,
+                    logger=packet_logging_enabled(), engineio_logger=packet_logging_enabled(),
+                    max_http_buffer_size=MAX_MESSAGE_SIZE,
+                    ping_timeout=60,ping_interval=25,
+                    client_manager=create_client_manager(os.getenv('SOCKETIO_MESSAGE_QUEUE'))
                     )
 
+def limit_websocket_messages(max_size):
+    """Enforce max_size while WebSocket messages are read, not after.
+    
+    Engine.IO checks a message against max_http_buffer_size only once it
+    has been received in full (polling requests are checked by their
+    Content-Length up front). In threading mode the WebSocket is served by
+    simple-websocket, which stops reading as soon as a message grows past
+    the limit and sends a close frame (code 1009). It neither wakes
+    Engine.IO's blocked receive() nor releases werkzeug's socket, though,
+    so the sender would stall mid-message and look connected until the
+    ping timeout; the connection is shut down here instead, and the phone
+    sees a disconnect. gevent-websocket has no such option, so under
+    gevent the check stays after the read.
+    """
+    eio = socketio.server.eio
+    websocket_class = eio._async.get('websocket')
+    if eio.async_mode != 'threading' or websocket_class is None:
+        return
+    from simple_websocket import ConnectionClosed
+    
+    class LimitedWebSocket(websocket_class):
+        def __init__(self, handler, server, **kwargs):
+            super().__init__(handler, server, max_message_size=max_size, **kwargs)
+        
+        def wait(self):
+            while True:
+                try:
+                    message = self.ws.receive(timeout=WEBSOCKET_CLOSE_POLL_INTERVAL)
+                except ConnectionClosed:
+                    message = None
+                if message is not None:
+                    return message
+                if not self.ws.connected:
+                    break
+            try:
+                self.ws.sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass  # already closed by the client
+            return None
+    
+    eio._async = dict(eio._async, websocket=LimitedWebSocket)
+
+# How often a WebSocket waiting for messages checks that its reader is still running
+WEBSOCKET_CLOSE_POLL_INTERVAL = 1.0
+
+limit_websocket_messages(MAX_MESSAGE_SIZE)
+
+# Upload validation settings
+ALLOWED_TYPES = {'image/jpeg', 'image/png', 'image/jpg', 'image/webp'}
+MAX_FILE_SIZE = 10 * 1024 * 1024  # 10MB
+MAX_CHUNK_SIZE = 1024 * 1024  # 1MB per upload_chunk message
+SNIFF_LENGTH = 12  # enough for the JPEG, PNG and RIFF/WEBP signatures
+BASE64_SNIFF_LENGTH = SNIFF_LENGTH // 3 * 4
+NOT_AN_IMAGE = 'File is not a JPEG, PNG or WebP image'
+UPLOAD_ID_PATTERN = re.compile(r'^[A-Za-z0-9_-]{1,64}$')
+SHA256_PATTERN = re.compile(r'^[0-9A-Fa-f]{64}$')
+MAX_BATCH_ITEMS = 500
+
+# Limits for the resize options a desktop can ask phones to apply
+MIN_RESIZE_DIMENSION = 320
+MAX_RESIZE_DIMENSION = 8192
+DEFAULT_RESIZE_QUALITY = 0.85
+
+# Sessions not seen (registration or desktop heartbeat) for SESSION_TTL
+# seconds are evicted by a background sweeper; 0 disables expiry
+SESSION_TTL = int(os.getenv('SESSION_TTL', 3600))
+SESSION_SWEEP_INTERVAL = int(os.getenv('SESSION_SWEEP_INTERVAL', 30))
+
 # Store active sessions: {session_id: desktop_sid}
-active_sessions = {}
+# Shared between workers when SESSION_STORE_URL points at sqlite or redis
+active_sessions = create_session_store(os.getenv('SESSION_STORE_URL'), ttl=SESSION_TTL)
+
+# Chunked uploads in progress: {upload_id: upload state}
+# Only the running hash and the acknowledged offset are kept, never the data.
+# An upload the phone stops sending for UPLOAD_IDLE_TIMEOUT seconds (a closed
+# tab, a phone that never reconnected) is aborted by the sweeper.
+active_uploads = {}
+UPLOAD_IDLE_TIMEOUT = float(os.getenv('UPLOAD_IDLE_TIMEOUT', 120))
+
+# A binary event leaves as several Engine.IO packets (header, attachments)
+# and the client takes whatever arrives next as the attachment. Handlers for
+# different uploads run concurrently, so every event to a desktop goes out
+# under a per-session lock: {session_id: lock}
+# The lock is per process. With SOCKETIO_MESSAGE_QUEUE set, an emit is
+# published to the queue and sent by whichever worker holds the desktop's
+# connection, so ordering is only guaranteed for a single worker. A
+# misordered photo fails the desktop's checksum check and is not saved.
+desktop_send_locks = {}
+
+# Flow control: desktops that register with flow_control acknowledge every
+# relayed payload with 'desktop_ack'. At most DESKTOP_WINDOW_BYTES may be
+# unacknowledged per desktop; past that, phones are told to retry shortly
+# instead of the server queueing more data. Payloads not acknowledged within
+# DESKTOP_ACK_TIMEOUT seconds are written off so a lost ack cannot stall a
+# session. The state is per process: with several workers, only payloads
+# relayed by the desktop's own worker are limited.
+DESKTOP_WINDOW_BYTES = int(os.getenv('DESKTOP_WINDOW_BYTES', 4 * 1024 * 1024))
+DESKTOP_ACK_TIMEOUT = float(os.getenv('DESKTOP_ACK_TIMEOUT', 30))
+BUSY_RETRY_AFTER = 250  # milliseconds a phone waits before retrying
+WINDOW_POLL_INTERVAL = 0.05  # seconds between window checks for payloads the server relays on its own
+
+# {session_id: {'sid', 'in_flight': {ack_id: (size, sent_at)}, 'bytes', ...}}
+desktop_flows = {}
+flow_counters = {'deferred': 0, 'expired': 0}
+
+# Delivery acknowledgements: desktops that register with delivery_acks send
+# 'photo_stored' once a photo is on disk, and only then is the phone told
+# the upload succeeded. Deliveries are tracked by upload ID, so any number
+# can be outstanding; unconfirmed ones fail after DELIVERY_TIMEOUT seconds.
+DELIVERY_TIMEOUT = float(os.getenv('DELIVERY_TIMEOUT', 60))
+
+# {session_id: desktop_sid} for desktops that confirm saved photos
+acking_desktops = {}
+
+# Relayed photos awaiting confirmation: {upload_id: pending delivery}
+pending_deliveries = {}
+
+# Both are per process, like the flow-control window: with several workers,
+# only phones served by the desktop's own worker wait for photo_stored (which
+# arrives there). Phones on other workers are told 'ok' once their photo is
+# relayed, as with desktops that do not confirm saved photos.
+if os.getenv('SOCKETIO_MESSAGE_QUEUE'):
+    logger.warning("SOCKETIO_MESSAGE_QUEUE is set: delivery acknowledgements, flow control and "
+                   "event ordering only cover phones on the same worker as their desktop")
+
+# Optional store-and-forward spool: uploads for a desktop that disconnected
+# less than SPOOL_TTL seconds ago are held (up to SPOOL_MAX_BYTES in total)
+# and flushed in order when it registers again. Off unless SPOOL_URL is set
+# (see backends.py).
+SPOOL_MAX_BYTES = int(os.getenv('SPOOL_MAX_BYTES', 100 * 1024 * 1024))
+SPOOL_TTL = int(os.getenv('SPOOL_TTL', 120))
+SPOOL_CHUNK_SIZE = 512 * 1024
+spool = create_spool(os.getenv('SPOOL_URL'), max_bytes=SPOOL_MAX_BYTES, ttl=SPOOL_TTL)
+spool_admission_lock = threading.Lock()
+
+# Upload progress: chunked uploads report the bytes relayed so far to the
+# desktop at most every PROGRESS_INTERVAL seconds, along with the session's
+# current throughput. Throughput is kept per session (bytes, chunk sizes,
+# busy waits, a smoothed rate) and reported by /health, to spot slow links
+# and tune chunk sizes.
+PROGRESS_INTERVAL = 0.25
+THROUGHPUT_WINDOW = 1.0  # seconds of traffic per rate sample
+THROUGHPUT_SMOOTHING = 0.3  # weight of the newest sample
+
+# {session_id: throughput state}
+session_throughput = {}
+
+# Phones on the upload page: {sid: session_id}
+mobile_clients = {}
+
+# Prometheus-style metrics served at /metrics (see relay_metrics.py).
+# Counters and gauges are per process, except those read from the session
+# store and spool, which may be shared.
+LOOP_LAG_INTERVAL = 1.0
+metrics = Metrics()
+metrics.counter('relay_uploads_total', 'Uploads by outcome')
+metrics.counter('relay_rejections_total', 'Uploads and chunks rejected by validation, by reason')
+metrics.counter('relay_received_bytes_total', 'Photo bytes received from phones')
+metrics.counter('relay_relayed_bytes_total', 'Photo bytes sent to desktops')
+metrics.histogram('relay_payload_size_bytes', 'Size of photos relayed to desktops', SIZE_BUCKETS)
+metrics.histogram('relay_latency_seconds', 'Time from the start of an upload until it is relayed to the desktop', LATENCY_BUCKETS)
+metrics.histogram('relay_delivery_latency_seconds', 'Time from relaying a photo until the desktop confirms it is saved', LATENCY_BUCKETS)
+metrics.histogram('relay_loop_lag_seconds', f'How late a {LOOP_LAG_INTERVAL:g}s timer fires; grows when the worker is saturated', LATENCY_BUCKETS)
+metrics.gauge('relay_desktops_connected', 'Registered desktops', lambda: active_sessions.stats()['desktops'])
+metrics.gauge('relay_phones_connected', 'Phones registered with this process', lambda: len(mobile_clients))
+metrics.gauge('relay_uploads_in_progress', 'Chunked uploads in progress', lambda: len(active_uploads))
+metrics.gauge('relay_pending_deliveries', 'Relayed photos awaiting confirmation from the desktop', lambda: len(pending_deliveries))
+metrics.gauge('relay_flow_in_flight_bytes', 'Bytes relayed to flow-controlled desktops and not yet acknowledged',
+              lambda: flow_stats()['in_flight_bytes'])
+metrics.gauge('relay_flow_deferred_total', 'Payloads held back because a desktop window was full',
+              lambda: flow_counters['deferred'], kind='counter')
+metrics.gauge('relay_spool_bytes', 'Bytes held for desktops that are away',
+              lambda: spool.usage()[1] if spool is not None else 0)
+metrics.gauge('relay_threads', 'Threads in this process (one per running handler in threading mode)',
+              threading.active_count)
+
+sweeper_lock = threading.Lock()
+sweeper_started = False
+
+def drop_uploads(session_ids):
+    """Forget chunked uploads and flow state for sessions that can no longer receive them"""
+    for upload_id, upload in list(active_uploads.items()):
+        if upload['session_id'] in session_ids:
+            active_uploads.pop(upload_id, None)
+    for session_id in session_ids:
+        desktop_flows.pop(session_id, None)
+        desktop_send_locks.pop(session_id, None)
+        acking_desktops.pop(session_id, None)
+        session_throughput.pop(session_id, None)
+    for upload_id, delivery in list(pending_deliveries.items()):
+        if delivery['session_id'] in session_ids:
+            fail_delivery(upload_id, 'Desktop disconnected before the photo was saved')
+
+def send_to_desktop(session_id, event, data):
+    """Emit to a desktop without interleaving packets with other uploads' events (per worker)"""
+    with desktop_send_locks.setdefault(session_id, threading.Lock()):
+        socketio.emit(event, data, room=f"desktop_{session_id}")
+
+def open_window(session_id, sid):
+    """Start flow control for a desktop that acknowledges deliveries"""
+    desktop_flows[session_id] = {
+        'sid': sid,
+        'in_flight': {},  # {ack_id: (size, sent_at)}, oldest first
+        'bytes': 0,
+        'next_ack_id': 0,
+        'lock': threading.Lock()
+    }
+
+def reserve_window(session_id, size):
+    """Account for a payload about to be relayed to a desktop.
+    
+    Returns (admitted, ack_id). ack_id is None when the desktop does not
+    use flow control. A payload is always admitted when nothing is in
+    flight, so one larger than the window can still get through.
+    """
+    flow = desktop_flows.get(session_id)
+    if flow is None:
+        return True, None
+    
+    with flow['lock']:
+        in_flight = flow['in_flight']
+        
+        # Write off payloads whose ack never came
+        deadline = time.monotonic() - DESKTOP_ACK_TIMEOUT
+        while in_flight:
+            ack_id, (pending, sent_at) = next(iter(in_flight.items()))
+            if sent_at > deadline:
+                break
+            del in_flight[ack_id]
+            flow['bytes'] -= pending
+            flow_counters['expired'] += 1
+        
+        if in_flight and flow['bytes'] + size > DESKTOP_WINDOW_BYTES:
+            flow_counters['deferred'] += 1
+            return False, None
+        
+        ack_id = flow['next_ack_id']
+        flow['next_ack_id'] += 1
+        in_flight[ack_id] = (size, time.monotonic())
+        flow['bytes'] += size
+        return True, ack_id
+
+def release_window(session_id, sid, ack_id):
+    """Credit a payload the desktop has acknowledged"""
+    flow = desktop_flows.get(session_id)
+    if flow is None or flow['sid'] != sid:
+        return
+    with flow['lock']:
+        entry = flow['in_flight'].pop(ack_id, None)
+        if entry:
+            flow['bytes'] -= entry[0]
+
+def wait_for_window(session_id, size):
+    """Reserve window space for a payload the server relays on its own, waiting while it is full.
+    
+    For spool flushes and HTTP uploads, which have no phone to send back
+    and retry. Returns the ack_id (None without flow control).
+    """
+    admitted, ack_id = reserve_window(session_id, size)
+    while not admitted:
+        record_throughput(session_id, 0, busy=True)
+        socketio.sleep(WINDOW_POLL_INTERVAL)
+        admitted, ack_id = reserve_window(session_id, size)
+    return ack_id
+
+def flow_stats():
+    """Queue depths of flow-controlled desktops, reported by /health"""
+    depths = [(flow['bytes'], len(flow['in_flight'])) for flow in list(desktop_flows.values())]
+    return {
+        'desktops': len(depths),
+        'window_bytes': DESKTOP_WINDOW_BYTES,
+        'in_flight_bytes': sum(size for size, _ in depths),
+        'in_flight_messages': sum(count for _, count in depths),
+        'max_in_flight_bytes': max((size for size, _ in depths), default=0),
+        'deferred': flow_counters['deferred'],
+        'expired_acks': flow_counters['expired']
+    }
+
+def record_throughput(session_id, size, busy=False):
+    """Account for a chunk relayed (or held back) for a session; returns its rate in bytes/s"""
+    now = time.monotonic()
+    entry = session_throughput.get(session_id)
+    if entry is None:
+        entry = session_throughput.setdefault(session_id, {
+            'bytes': 0,
+            'chunks': 0,
+            'busy': 0,
+            'rate': 0.0,
+            'peak_rate': 0.0,
+            'window_start': now,
+            'window_bytes': 0,
+            'lock': threading.Lock()
+        })
+    with entry['lock']:
+        if busy:
+            entry['busy'] += 1
+            return entry['rate']
+        entry['bytes'] += size
+        entry['chunks'] += 1
+        entry['window_bytes'] += size
+        elapsed = now - entry['window_start']
+        if elapsed >= THROUGHPUT_WINDOW:
+            sample = entry['window_bytes'] / elapsed
+            entry['rate'] = sample if not entry['rate'] else \
+                THROUGHPUT_SMOOTHING * sample + (1 - THROUGHPUT_SMOOTHING) * entry['rate']
+            entry['peak_rate'] = max(entry['peak_rate'], entry['rate'])
+            entry['window_start'] = now
+            entry['window_bytes'] = 0
+        # Until a full window has passed, estimate from what arrived so far
+        if not entry['rate'] and elapsed > 0:
+            return entry['window_bytes'] / elapsed
+        return entry['rate']
+
+def throughput_stats():
+    """Per-session throughput, reported by /health.
+    
+    Sessions are listed by a hash of their ID: the ID itself lets anyone
+    upload to that desktop.
+    """
+    sessions = []
+    for session_id, entry in list(session_throughput.items()):
+        sessions.append({
+            'session': hashlib.sha256(session_id.encode()).hexdigest()[:12],
+            'bytes': entry['bytes'],
+            'chunks': entry['chunks'],
+            'avg_chunk_bytes': entry['bytes'] // entry['chunks'] if entry['chunks'] else 0,
+            'busy_waits': entry['busy'],
+            'rate_mbps': round(entry['rate'] / (1024 * 1024), 2),
+            'peak_rate_mbps': round(entry['peak_rate'] / (1024 * 1024), 2)
+        })
+    sessions.sort(key=lambda item: item['rate_mbps'])
+    return sessions
+
+def expect_delivery(upload_id, session_id, phone_sid=None):
+    """Hold a relayed photo's outcome until the desktop confirms it.
+    
+    phone_sid is set for legacy upload_photo senders, which are answered
+    with upload_success / upload_error; chunked uploads are answered in the
+    session's mobile room so a reconnected phone still hears the result.
+    """
+    pending_deliveries[upload_id] = {
+        'session_id': session_id,
+        'phone_sid': phone_sid,
+        'relayed_at': time.monotonic(),
+        'expires': time.monotonic() + DELIVERY_TIMEOUT
+    }
+
+def confirm_delivery(upload_id, filename=None):
+    """The desktop saved the photo: report success to the phone"""
+    delivery = pending_deliveries.pop(upload_id, None)
+    if delivery is None:
+        return
+    if delivery['phone_sid']:
+        socketio.emit('upload_success', {'message': 'Photo saved on desktop'}, to=delivery['phone_sid'])
+    else:
+        socketio.emit('upload_saved', {'upload_id': upload_id, 'filename': filename},
+                      room=f"mobile_{delivery['session_id']}")
+
+def fail_delivery(upload_id, message):
+    """The desktop could not save the photo: report the failure to the phone"""
+    delivery = pending_deliveries.pop(upload_id, None)
+    if delivery is None:
+        return
+    report_failure(upload_id, delivery['session_id'], delivery['phone_sid'], message)
+
+def report_failure(upload_id, session_id, phone_sid, message):
+    """Tell the phone a relayed or spooled photo will not be saved"""
+    metrics.inc('relay_uploads_total', outcome='failed')
+    logger.warning(f"Delivery of {upload_id} failed: {message}")
+    if phone_sid:
+        socketio.emit('upload_error', {'message': message}, to=phone_sid)
+    else:
+        socketio.emit('upload_failed', {'upload_id': upload_id, 'message': message},
+                      room=f"mobile_{session_id}")
+
+def desktop_state(session_id):
+    """'online', 'away' (recently disconnected, uploads are spooled) or None"""
+    if not session_id:
+        return None
+    if session_id in active_sessions:
+        return 'online'
+    if spool is not None and spool.is_held(session_id):
+        return 'away'
+    return None
+
+def spool_upload(session_id, meta, data):
+    """Hold a complete upload until the desktop registers again"""
+    if spool.add(session_id, meta, data):
+        metrics.inc('relay_uploads_total', outcome='spooled')
+        events.event('upload_spooled', session_id=session_id, upload_id=meta['upload_id'], size=len(data))
+        return True
+    logger.warning(f"Spool full or session no longer held, upload {meta['upload_id']} rejected")
+    reject('spool_full')
+    return False
+
+def admit_to_spool(upload):
+    """Register an upload for an away desktop if the spool can take it once complete.
+    
+    Uploads still being received count against SPOOL_MAX_BYTES by their
+    declared size, so concurrent ones cannot together buffer past it (per
+    process: a shared DiskSpool only sees completed uploads from others).
+    """
+    with spool_admission_lock:
+        buffering = sum(other['total_size'] for other in list(active_uploads.values()) if other['spool'] is not None)
+        if not spool.fits(buffering + upload['total_size']):
+            return False
+        active_uploads[upload['upload_id']] = upload
+        return True
+
+def count_relayed(size, started=None, path=None):
+    """Record a photo relayed to a desktop in full"""
+    metrics.inc('relay_uploads_total', outcome='relayed')
+    metrics.observe('relay_payload_size_bytes', size)
+    if started is not None:
+        metrics.observe('relay_latency_seconds', time.monotonic() - started, path=path)
+
+def deliver_upload(session_id, meta, source):
+    """Relay a complete upload to the desktop as photo_begin / photo_chunk... / photo_end.
+    
+    source is a binary file object, read SPOOL_CHUNK_SIZE at a time and
+    sent through the desktop's flow-control window. Returns False, without
+    finishing, if the desktop went away (or reconnected) meanwhile.
+    """
+    upload_id = meta['upload_id']
+    sid = active_sessions.get(session_id)
+    if sid is None:
+        return False
+    
+    send_to_desktop(session_id, 'photo_begin', {
+        'upload_id': upload_id,
+        'batch_id': meta.get('batch_id'),
+        'mime_type': meta['mime_type'],
+        'total_size': meta['size'],
+        'sha256': meta['sha256']
+    })
+    offset = 0
+    for seq, piece in enumerate(iter(functools.partial(source.read, SPOOL_CHUNK_SIZE), b'')):
+        ack_id = wait_for_window(session_id, len(piece))
+        if active_sessions.get(session_id) != sid:
+            return False
+        send_to_desktop(session_id, 'photo_chunk', {
+            'upload_id': upload_id,
+            'seq': seq,
+            'offset': offset,
+            'data': piece,
+            'ack_id': ack_id
+        })
+        metrics.inc('relay_relayed_bytes_total', len(piece))
+        offset += len(piece)
+    
+    # Registered only now, so a desktop leaving mid-way does not fail it
+    expect_delivery(upload_id, session_id, phone_sid=meta.get('phone_sid'))
+    send_to_desktop(session_id, 'photo_end', {'upload_id': upload_id, 'sha256': meta['sha256']})
+    count_relayed(offset)
+    
+    # Desktops that do not confirm saved photos: relayed counts as delivered
+    if session_id not in acking_desktops:
+        confirm_delivery(upload_id)
+    return True
+
+def deliver_or_spool(session_id, meta, source):
+    """Deliver a complete upload, spooling it again if the desktop drops off meanwhile.
+    
+    Returns 'relayed', 'spooled', or None when it can be neither (the
+    phone has then been told).
+    """
+    with source:
+        while not deliver_upload(session_id, meta, source):
+            source.seek(0)
+            state = desktop_state(session_id)
+            if state == 'away' and spool.add(session_id, meta, source.read()):
+                return 'spooled'
+            if state != 'online':
+                report_failure(meta['upload_id'], session_id, meta.get('phone_sid'),
+                               'Desktop not connected. Please ensure the desktop app is running.')
+                return None
+    return 'relayed'
+
+def flush_spool(session_id):
+    """Background task: deliver uploads spooled while the desktop was away, oldest first"""
+    entries = spool.release(session_id)
+    for meta, source in entries:
+        deliver_or_spool(session_id, meta, source)
+    if entries:
+        logger.info(f"Flushed {len(entries)} spooled upload(s) to session: {session_id}")
+
+def expire_deliveries():
+    """Fail deliveries the desktop never confirmed"""
+    now = time.monotonic()
+    for upload_id, delivery in list(pending_deliveries.items()):
+        if delivery['expires'] <= now:
+            fail_delivery(upload_id, 'Desktop did not confirm the photo was saved')
+
+def expire_uploads():
+    """Abort chunked uploads the phone abandoned, so the desktop drops its partial file"""
+    deadline = time.monotonic() - UPLOAD_IDLE_TIMEOUT
+    for upload_id, upload in list(active_uploads.items()):
+        if upload['active_at'] > deadline:
+            continue
+        with upload['lock']:
+            # A chunk may have arrived, or upload_end finished it, meanwhile
+            if upload['active_at'] > deadline or active_uploads.get(upload_id) is not upload:
+                continue
+            active_uploads.pop(upload_id, None)
+        if upload['spool'] is None:
+            send_to_desktop(upload['session_id'], 'photo_abort', {'upload_id': upload_id})
+        events.event('upload_expired', session_id=upload['session_id'], upload_id=upload_id, offset=upload['offset'])
+
+def sweep_sessions():
+    """Background task: evict sessions whose TTL has expired and expire deliveries"""
+    while True:
+        socketio.sleep(SESSION_SWEEP_INTERVAL)
+        try:
+            evicted = active_sessions.evict_expired()
+            if evicted:
+                logger.info(f"Evicted {len(evicted)} expired session(s)")
+                drop_uploads(set(evicted))
+            expire_deliveries()
+            expire_uploads()
+            if spool is not None:
+                for meta in spool.evict_expired():
+                    report_failure(meta['upload_id'], meta['session_id'], meta.get('phone_sid'),
+                                   'Desktop did not come back in time. Please send the photo again.')
+        except Exception as e:
+            logger.error(f"Error sweeping sessions: {str(e)}")
+
+def monitor_loop():
+    """Background task: measure how late timers fire, a sign of a saturated worker"""
+    while True:
+        started = time.monotonic()
+        socketio.sleep(LOOP_LAG_INTERVAL)
+        metrics.observe('relay_loop_lag_seconds', max(0.0, time.monotonic() - started - LOOP_LAG_INTERVAL))
+
+def start_sweeper():
+    """Start the session sweeper and loop monitor once per process"""
+    global sweeper_started
+    with sweeper_lock:
+        if not sweeper_started:
+            socketio.start_background_task(sweep_sessions)
+            socketio.start_background_task(monitor_loop)
+            sweeper_started = True
 
 @app.route('/')
 def index():
@@ -52,50 +631,157 @@ def upload_page():
 @app.route('/health')
 def health():
     """Health check endpoint"""
+    stats = active_sessions.stats()
     return jsonify({
         'status': 'healthy',
-        'active_sessions': len(active_sessions)
+        'active_sessions': stats['sessions'],
+        'sessions': stats,
+        'flow': flow_stats(),
+        'pending_deliveries': len(pending_deliveries),
+        'throughput': throughput_stats(),
+        'spool': spool.stats() if spool is not None else None
     })
 
+@app.route('/metrics')
+def metrics_endpoint():
+    """Prometheus scrape endpoint"""
+    return Response(metrics.render(), content_type=CONTENT_TYPE)
+
 @socketio.on('connect')
 def handle_connect():
     """Handle client connection"""
-    logger.info(f"Client connected: {request.sid}")
+    events.event('client_connected', sid=request.sid)
+    start_sweeper()
 
 @socketio.on('disconnect')
 def handle_disconnect():
     """Handle client disconnection"""
-    logger.info(f"Client disconnected: {request.sid}")
+    events.event('client_disconnected', sid=request.sid)
+    mobile_clients.pop(request.sid, None)
     
     # Remove from active sessions if it was a desktop
-    sessions_to_remove = [sid for sid, desktop_sid in active_sessions.items() if desktop_sid == request.sid]
+    sessions_to_remove = active_sessions.remove_sid(request.sid)
     for session_id in sessions_to_remove:
-        del active_sessions[session_id]
         logger.info(f"Removed session: {session_id}")
+    
+    # Chunked uploads to a disconnected desktop can no longer be delivered;
+    # new ones are spooled for a while in case it comes back
+    if sessions_to_remove:
+        if spool is not None:
+            for session_id in sessions_to_remove:
+                spool.hold(session_id)
+        drop_uploads(set(sessions_to_remove))
+
+def parse_upload_options(options):
+    """Validate the upload options a desktop asks phones to apply.
+    
+    Returns {'max_dimension': int, 'quality': float} for a resize request,
+    or None to have phones send originals.
+    """
+    if not isinstance(options, dict):
+        return None
+    
+    max_dimension = options.get('max_dimension')
+    if not isinstance(max_dimension, int) or not MIN_RESIZE_DIMENSION <= max_dimension <= MAX_RESIZE_DIMENSION:
+        return None
+    
+    quality = options.get('quality', DEFAULT_RESIZE_QUALITY)
+    if not isinstance(quality, (int, float)) or not 0.1 <= quality <= 1:
+        quality = DEFAULT_RESIZE_QUALITY
+    
+    return {'max_dimension': max_dimension, 'quality': float(quality)}
 
 @socketio.on('register_desktop')
 def handle_register_desktop(data):
     """Register desktop client"""
     session_id = data.get('session_id')
     if session_id:
+        upload_options = parse_upload_options(data.get('upload_options'))
         join_room(f"desktop_{session_id}")
-        active_sessions[session_id] = request.sid
+        active_sessions.register(session_id, request.sid, upload_options)
+        if data.get('flow_control'):
+            open_window(session_id, request.sid)
+        else:
+            desktop_flows.pop(session_id, None)
+        if data.get('delivery_acks'):
+            acking_desktops[session_id] = request.sid
+        else:
+            acking_desktops.pop(session_id, None)
         logger.info(f"Desktop registered for session: {session_id} (sid: {request.sid})")
         emit('registration_success', {'message': 'Desktop registered successfully'})
+        
+        # Phones already on the page pick up changed options immediately
+        socketio.emit('upload_options', {'upload_options': upload_options}, room=f"mobile_{session_id}")
+        
+        # Back after a short disconnect: deliver what was spooled meanwhile,
+        # through the window just opened
+        if spool is not None:
+            socketio.start_background_task(flush_spool, session_id)
     else:
         emit('registration_error', {'message': 'No session ID provided'})
 
+@socketio.on('heartbeat')
+def handle_heartbeat(data):
+    """Keep a desktop session alive"""
+    session_id = data.get('session_id')
+    if not session_id:
+        return
+    
+    owner = active_sessions.get(session_id)
+    if owner == request.sid:
+        active_sessions.touch(session_id)
+    elif owner is None:
+        # Evicted while the desktop was still connected: register it again
+        join_room(f"desktop_{session_id}")
+        active_sessions.register(session_id, request.sid, parse_upload_options(data.get('upload_options')))
+        if data.get('flow_control'):
+            open_window(session_id, request.sid)
+        if data.get('delivery_acks'):
+            acking_desktops[session_id] = request.sid
+        logger.info(f"Desktop re-registered for session: {session_id} (sid: {request.sid})")
+
+@socketio.on('desktop_ack')
+def handle_desktop_ack(data):
+    """A desktop has taken delivery of a relayed payload"""
+    release_window(data.get('session_id'), request.sid, data.get('ack_id'))
+
+@socketio.on('photo_stored')
+def handle_photo_stored(data):
+    """A desktop reports whether it saved a relayed photo"""
+    upload_id = data.get('upload_id')
+    delivery = pending_deliveries.get(upload_id)
+    if delivery is None or acking_desktops.get(delivery['session_id']) != request.sid:
+        return
+    
+    if data.get('status') == 'ok':
+        metrics.inc('relay_uploads_total', outcome='saved')
+        metrics.observe('relay_delivery_latency_seconds', time.monotonic() - delivery['relayed_at'])
+        confirm_delivery(upload_id, data.get('filename'))
+        events.event('upload_saved', upload_id=upload_id)
+    else:
+        fail_delivery(upload_id, data.get('message') or 'Desktop could not save the photo')
+
 @socketio.on('register_mobile')
 def handle_register_mobile(data):
     """Register mobile client"""
     session_id = data.get('session_id')
     if session_id:
         join_room(f"mobile_{session_id}")
+        mobile_clients[request.sid] = session_id
         logger.info(f"Mobile registered for session: {session_id} (sid: {request.sid})")
         
         # Check if desktop is connected
-        if session_id in active_sessions:
-            emit('registration_success', {'message': 'Connected to desktop'})
+        state = desktop_state(session_id)
+        if state == 'online':
+            emit('registration_success', {
+                'message': 'Connected to desktop',
+                'upload_options': active_sessions.get_options(session_id)
+            })
+        elif state == 'away':
+            emit('registration_success', {
+                'message': 'Desktop is reconnecting. Photos will be delivered when it is back.',
+                'upload_options': None
+            })
         else:
             emit('registration_error', {'message': 'Desktop not found. Please check if the app is running.'})
     else:
@@ -104,57 +790,667 @@ def handle_register_mobile(data):
 @socketio.on('upload_photo')
 def handle_upload(data):
     """Handle photo upload from mobile"""
+    started = time.monotonic()
     session_id = data.get('session_id')
     photo_data = data.get('photo')
     mime_type = data.get('mime_type', 'image/jpeg')
-    file_size = data.get('file_size', 0)
     
-    logger.info(f"Photo upload request from session: {session_id}, size: {file_size} bytes")
+    # Current clients send the photo as a binary attachment (bytes); older
+    # clients still send a base64 string, which is relayed untouched
+    is_binary = isinstance(photo_data, (bytes, bytearray))
+    received = len(photo_data) if isinstance(photo_data, (bytes, bytearray, str)) else 0
+    
+    events.event('photo_upload', session_id=session_id, size=received, encoding='binary' if is_binary else 'base64')
+    metrics.inc('relay_received_bytes_total', received)
     
     # Validate session
-    if not session_id or session_id not in active_sessions:
+    state = desktop_state(session_id)
+    if state is None:
         logger.warning(f"Invalid session or desktop not connected: {session_id}")
+        reject('desktop_not_connected')
         emit('upload_error', {'message': 'Desktop not connected. Please ensure the desktop app is running.'})
         return
     
     # Validate data
     if not photo_data:
         logger.warning("No photo data received")
+        reject('no_data')
         emit('upload_error', {'message': 'No photo data received'})
         return
     
     # Validate file type
-    allowed_types = {'image/jpeg', 'image/png', 'image/jpg', 'image/webp'}
-    if mime_type not in allowed_types:
+    if mime_type not in ALLOWED_TYPES:
         logger.warning(f"Invalid file type: {mime_type}")
+        reject('invalid_type')
         emit('upload_error', {'message': f'Invalid file type: {mime_type}'})
         return
     
+    # The declared size and type are not trusted: the real size and the
+    # format's magic bytes are read from the payload itself
+    try:
+        file_size, head = inspect_payload(photo_data)
+    except (ValueError, TypeError):
+        reject('invalid_data')
+        emit('upload_error', {'message': 'Invalid photo data'})
+        return
+    
+    sniffed_type = sniff_image_type(head)
+    if sniffed_type is None:
+        logger.warning(f"Payload is not an image (declared {mime_type})")
+        reject('not_an_image')
+        emit('upload_error', {'message': NOT_AN_IMAGE})
+        return
+    mime_type = sniffed_type
+    
     # Validate file size
-    max_size = 10 * 1024 * 1024  # 10MB
-    if file_size > max_size:
+    if file_size > MAX_FILE_SIZE:
         logger.warning(f"File too large: {file_size} bytes")
+        reject('too_large')
         emit('upload_error', {'message': 'File too large (max 10MB)'})
         return
     
+    # Desktop briefly away: keep the photo and deliver it when it is back
+    if state == 'away':
+        try:
+            photo = bytes(photo_data) if is_binary else base64.b64decode(photo_data)
+        except (ValueError, TypeError):
+            reject('invalid_data')
+            emit('upload_error', {'message': 'Invalid photo data'})
+            return
+        meta = {
+            'upload_id': uuid.uuid4().hex,
+            'mime_type': mime_type,
+            'sha256': hashlib.sha256(photo).hexdigest(),
+            'phone_sid': request.sid
+        }
+        if spool_upload(session_id, meta, photo):
+            emit('upload_queued', {'message': 'Desktop is reconnecting. The photo will be delivered when it is back.'})
+        else:
+            emit('upload_error', {'message': 'Desktop not connected. Please ensure the desktop app is running.'})
+        return
+    
+    # Hold back while the desktop is still taking delivery of earlier photos
+    admitted, ack_id = reserve_window(session_id, len(photo_data))
+    if not admitted:
+        emit('upload_error', {
+            'message': 'Desktop is busy receiving photos. Please try again in a moment.',
+            'busy': True,
+            'retry_after': BUSY_RETRY_AFTER
+        })
+        return
+    
+    # Desktops that confirm saved photos get an ID to confirm this one by
+    upload_id = None
+    if session_id in acking_desktops:
+        upload_id = uuid.uuid4().hex
+        expect_delivery(upload_id, session_id, phone_sid=request.sid)
+    
     # Forward to desktop
     try:
-        socketio.emit('photo_received', {
+        send_to_desktop(session_id, 'photo_received', {
             'photo': photo_data,
+            'encoding': 'binary' if is_binary else 'base64',
             'mime_type': mime_type,
-            'file_size': file_size
-        }, room=f"desktop_{session_id}")
+            'file_size': file_size,
+            'ack_id': ack_id,
+            'upload_id': upload_id
+        })
         
-        logger.info(f"Photo successfully relayed to desktop for session: {session_id}")
+        events.event('photo_relayed', session_id=session_id, size=file_size)
+        metrics.inc('relay_relayed_bytes_total', len(photo_data))
+        count_relayed(file_size, started, path='legacy')
         
-        # Confirm to mobile
-        emit('upload_success', {'message': 'Photo sent successfully'})
+        # Confirm to mobile now, unless the desktop will confirm once saved
+        if upload_id is None:
+            emit('upload_success', {'message': 'Photo sent successfully'})
         
     except Exception as e:
         logger.error(f"Error relaying photo: {str(e)}")
+        if upload_id:
+            pending_deliveries.pop(upload_id, None)
         emit('upload_error', {'message': 'Failed to send photo to desktop'})
 
+def reject(reason):
+    """Count an upload or chunk turned away by validation"""
+    metrics.inc('relay_rejections_total', reason=reason)
+    metrics.inc('relay_uploads_total', outcome='rejected')
+
+def upload_ack(upload, status='ok'):
+    """Acknowledgement returned to the phone for chunked upload events"""
+    return {
+        'status': status,
+        'upload_id': upload['upload_id'],
+        'offset': upload['offset'],
+        'next_seq': upload['next_seq']
+    }
+
+def upload_error(message, reason=None, retry=False):
+    """Error acknowledgement returned to the phone for chunked upload events.
+    
+    reason, when given, is counted as a validation rejection in /metrics.
+    retry tells the page to announce the upload again rather than give up.
+    """
+    if reason:
+        reject(reason)
+    response = {'status': 'error', 'message': message}
+    if retry:
+        response['retry'] = True
+    return response
+
+def inspect_payload(photo_data):
+    """(size, first SNIFF_LENGTH bytes) of a binary or base64 photo.
+    
+    Only the head of a base64 string is decoded; its size follows from its
+    length and padding. Raises ValueError or TypeError for anything else.
+    """
+    if isinstance(photo_data, (bytes, bytearray)):
+        return len(photo_data), bytes(photo_data[:SNIFF_LENGTH])
+    if len(photo_data) % 4:
+        raise ValueError('Truncated base64 data')
+    size = len(photo_data) // 4 * 3 - photo_data[-2:].count('=')
+    return size, base64.b64decode(photo_data[:BASE64_SNIFF_LENGTH], validate=True)
+
+def sniff_image_type(head):
+    """Image type named by a payload's magic bytes, or None"""
+    if head.startswith(b'\xff\xd8\xff'):
+        return 'image/jpeg'
+    if head.startswith(b'\x89PNG\r\n\x1a\n'):
+        return 'image/png'
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'image/webp'
+    return None
+
+def valid_id(value):
+    """Upload and batch IDs are short opaque tokens chosen by the phone"""
+    return isinstance(value, str) and bool(UPLOAD_ID_PATTERN.match(value))
+
+@socketio.on('batch_begin')
+def handle_batch_begin(data):
+    """Announce a batch of uploads to the desktop"""
+    batch_id = data.get('batch_id')
+    session_id = data.get('session_id')
+    items = data.get('items')
+    
+    if not valid_id(batch_id):
+        return upload_error('Invalid batch ID', 'invalid_id')
+    
+    # Validate session (a desktop that is away misses the manifest, not the photos)
+    if desktop_state(session_id) is None:
+        logger.warning(f"Invalid session or desktop not connected: {session_id}")
+        return upload_error('Desktop not connected. Please ensure the desktop app is running.', 'desktop_not_connected')
+    
+    if not isinstance(items, list) or not items:
+        return upload_error('Empty batch', 'invalid_batch')
+    if len(items) > MAX_BATCH_ITEMS:
+        return upload_error(f'Too many photos in one batch (max {MAX_BATCH_ITEMS})', 'invalid_batch')
+    
+    manifest = []
+    for item in items:
+        size = item.get('size') if isinstance(item, dict) else None
+        if not valid_id(item.get('upload_id') if isinstance(item, dict) else None) or not isinstance(size, int):
+            return upload_error('Invalid batch item', 'invalid_batch')
+        manifest.append({'upload_id': item['upload_id'], 'mime_type': item.get('mime_type'), 'size': size})
+    
+    send_to_desktop(session_id, 'batch_manifest', {
+        'batch_id': batch_id,
+        'count': len(manifest),
+        'total_size': sum(item['size'] for item in manifest),
+        'items': manifest
+    })
+    
+    events.event('batch_announced', session_id=session_id, batch_id=batch_id, count=len(manifest))
+    return {'status': 'ok', 'batch_id': batch_id}
+
+def new_upload(upload_id, session_id, state, mime_type, total_size, sha256, batch_id):
+    """Validate a new upload and register it in active_uploads.
+    
+    state is the desktop's ('online' or 'away'); an upload for a desktop
+    that is away is buffered for the spool and counted against it. Returns
+    (upload, None, None), or (None, error ack, HTTP status) if it is
+    turned down.
+    """
+    # Validate file type
+    if mime_type not in ALLOWED_TYPES:
+        logger.warning(f"Invalid file type: {mime_type}")
+        return None, upload_error(f'Invalid file type: {mime_type}', 'invalid_type'), 415
+    
+    # Validate file size
+    if not isinstance(total_size, int) or total_size <= 0:
+        return None, upload_error('Invalid file size', 'invalid_size'), 400
+    if total_size > MAX_FILE_SIZE:
+        logger.warning(f"File too large: {total_size} bytes")
+        return None, upload_error('File too large (max 10MB)', 'too_large'), 413
+    upload = {
+        'upload_id': upload_id,
+        'session_id': session_id,
+        'mime_type': mime_type,
+        'total_size': total_size,
+        'sha256': sha256,
+        'hasher': hashlib.sha256(),
+        'offset': 0,
+        'next_seq': 0,
+        'batch_id': batch_id,
+        'started': time.monotonic(),
+        'active_at': time.monotonic(),
+        'progress_at': 0.0,
+        'spool': bytearray() if state == 'away' else None,  # buffered while the desktop is away
+        'lock': threading.Lock()
+    }
+    if state == 'away':
+        if not admit_to_spool(upload):
+            return None, upload_error('Desktop not connected and the server cannot hold more photos. '
+                                      'Please try again later.', 'spool_full'), 503
+    else:
+        active_uploads[upload_id] = upload
+    return upload, None, None
+
+@socketio.on('upload_begin')
+def handle_upload_begin(data):
+    """Start (or resume) a chunked upload from mobile"""
+    upload_id = data.get('upload_id')
+    session_id = data.get('session_id')
+    mime_type = data.get('mime_type', 'image/jpeg')
+    total_size = data.get('total_size', 0)
+    sha256 = data.get('sha256')
+    batch_id = data.get('batch_id')
+    
+    if not valid_id(upload_id):
+        return upload_error('Invalid upload ID', 'invalid_id')
+    if batch_id is not None and not valid_id(batch_id):
+        return upload_error('Invalid batch ID', 'invalid_id')
+    if sha256 is not None and not (isinstance(sha256, str) and SHA256_PATTERN.match(sha256)):
+        return upload_error('Invalid checksum', 'invalid_id')
+    
+    # Validate session
+    state = desktop_state(session_id)
+    if state is None:
+        logger.warning(f"Invalid session or desktop not connected: {session_id}")
+        return upload_error('Desktop not connected. Please ensure the desktop app is running.', 'desktop_not_connected')
+    
+    # A reconnecting phone resumes from the last acknowledged offset
+    upload = active_uploads.get(upload_id)
+    if upload and upload['session_id'] == session_id:
+        upload['active_at'] = time.monotonic()
+        events.event('upload_resumed', upload_id=upload_id, offset=upload['offset'])
+        return upload_ack(upload)
+    
+    upload, error, _ = new_upload(upload_id, session_id, state, mime_type, total_size, sha256, batch_id)
+    if error:
+        return error
+    
+    if state == 'away':
+        events.event('upload_started', session_id=session_id, upload_id=upload_id, size=total_size, spooled=True)
+        return upload_ack(upload)
+    
+    send_to_desktop(session_id, 'photo_begin', {
+        'upload_id': upload_id,
+        'batch_id': batch_id,
+        'mime_type': mime_type,
+        'total_size': total_size,
+        'sha256': sha256
+    })
+    
+    events.event('upload_started', session_id=session_id, upload_id=upload_id, size=total_size)
+    return upload_ack(upload)
+
+@socketio.on('upload_chunk')
+def handle_upload_chunk(data):
+    """Relay one chunk of a chunked upload straight to the desktop"""
+    upload_id = data.get('upload_id')
+    seq = data.get('seq')
+    chunk = data.get('data')
+    
+    # Dropped with its desktop (or expired): upload_begin again spools it
+    # if the desktop is only away
+    upload = active_uploads.get(upload_id)
+    if not upload:
+        return upload_error('Unknown upload. Please start again.', retry=True)
+    
+    if not isinstance(chunk, (bytes, bytearray)) or not chunk:
+        return upload_error('No chunk data received', 'no_data')
+    if len(chunk) > MAX_CHUNK_SIZE:
+        return upload_error('Chunk too large', 'chunk_too_large')
+    
+    with upload['lock']:
+        upload['active_at'] = time.monotonic()
+        
+        # Duplicate or out-of-order chunk: tell the phone where to continue
+        if seq != upload['next_seq']:
+            return upload_ack(upload)
+        
+        if upload['offset'] + len(chunk) > upload['total_size']:
+            active_uploads.pop(upload_id, None)
+            send_to_desktop(upload['session_id'], 'photo_abort', {'upload_id': upload_id})
+            return upload_error('Upload exceeds declared size', 'exceeds_size')
+        
+        # The first chunk must start like an image; nothing more is relayed otherwise
+        if seq == 0 and sniff_image_type(chunk[:SNIFF_LENGTH]) is None:
+            active_uploads.pop(upload_id, None)
+            if upload['spool'] is None:
+                send_to_desktop(upload['session_id'], 'photo_abort', {'upload_id': upload_id})
+            logger.warning(f"Upload {upload_id} is not an image (declared {upload['mime_type']})")
+            return upload_error(NOT_AN_IMAGE, 'not_an_image')
+        
+        if upload['spool'] is not None:
+            metrics.inc('relay_received_bytes_total', len(chunk))
+            upload['spool'] += chunk
+            upload['hasher'].update(chunk)
+            upload['offset'] += len(chunk)
+            upload['next_seq'] += 1
+            return upload_ack(upload)
+        
+        # Desktop window full: the phone retries this chunk after a pause
+        admitted, ack_id = reserve_window(upload['session_id'], len(chunk))
+        if not admitted:
+            record_throughput(upload['session_id'], 0, busy=True)
+            ack = upload_ack(upload, status='busy')
+            ack['retry_after'] = BUSY_RETRY_AFTER
+            return ack
+        
+        metrics.inc('relay_received_bytes_total', len(chunk))
+        upload['hasher'].update(chunk)
+        send_to_desktop(upload['session_id'], 'photo_chunk', {
+            'upload_id': upload_id,
+            'seq': seq,
+            'offset': upload['offset'],
+            'data': chunk,
+            'ack_id': ack_id
+        })
+        metrics.inc('relay_relayed_bytes_total', len(chunk))
+        
+        upload['offset'] += len(chunk)
+        upload['next_seq'] += 1
+        report_progress(upload, record_throughput(upload['session_id'], len(chunk)))
+        return upload_ack(upload)
+
+def report_progress(upload, rate):
+    """Send the desktop upload_progress for an upload, at most once per PROGRESS_INTERVAL.
+    
+    Returns the event sent, or None when none was due.
+    """
+    now = time.monotonic()
+    if now - upload['progress_at'] < PROGRESS_INTERVAL or upload['offset'] >= upload['total_size']:
+        return None
+    upload['progress_at'] = now
+    progress = {
+        'upload_id': upload['upload_id'],
+        'relayed': upload['offset'],
+        'total_size': upload['total_size'],
+        'rate': round(rate)
+    }
+    send_to_desktop(upload['session_id'], 'upload_progress', progress)
+    return progress
+
+@socketio.on('upload_end')
+def handle_upload_end(data):
+    """Finish a chunked upload once every byte has been relayed"""
+    upload_id = data.get('upload_id')
+    upload = active_uploads.get(upload_id)
+    if not upload:
+        return upload_error('Unknown upload. Please start again.', retry=True)
+    
+    with upload['lock']:
+        if upload['offset'] != upload['total_size']:
+            return upload_ack(upload, status='incomplete')
+        
+        active_uploads.pop(upload_id, None)
+        digest = upload['hasher'].hexdigest()
+        if upload['sha256'] and upload['sha256'].lower() != digest:
+            logger.warning(f"Checksum mismatch for upload {upload_id}")
+            send_to_desktop(upload['session_id'], 'photo_abort', {'upload_id': upload_id})
+            return upload_error('Checksum mismatch. Please try again.', 'checksum_mismatch')
+        
+        if upload['spool'] is not None:
+            return finish_spooled_upload(upload, digest)
+        
+        return relay_finished_upload(upload, digest, 'chunked')
+
+def relay_finished_upload(upload, digest, path):
+    """Send photo_end for an upload relayed in full and return the phone's ack"""
+    upload_id = upload['upload_id']
+    session_id = upload['session_id']
+    
+    # Registered before photo_end goes out, so a fast confirmation is not lost
+    confirm = session_id in acking_desktops
+    if confirm:
+        expect_delivery(upload_id, session_id)
+    
+    send_to_desktop(session_id, 'photo_end', {'upload_id': upload_id, 'sha256': digest})
+    events.event('upload_relayed', session_id=session_id, upload_id=upload_id, size=upload['total_size'])
+    count_relayed(upload['total_size'], upload['started'], path=path)
+    
+    # 'relayed': the phone waits for upload_saved / upload_failed with this
+    # upload ID. The ack carries the upload ID, so batches can pipeline.
+    if confirm:
+        return {'status': 'relayed', 'upload_id': upload_id, 'timeout': DELIVERY_TIMEOUT}
+    return {'status': 'ok', 'upload_id': upload_id}
+
+def finish_spooled_upload(upload, digest):
+    """Spool a complete upload, or deliver it if the desktop is already back"""
+    session_id = upload['session_id']
+    meta = {
+        'upload_id': upload['upload_id'],
+        'batch_id': upload['batch_id'],
+        'mime_type': upload['mime_type'],
+        'sha256': digest,
+        'size': len(upload['spool'])
+    }
+    # Back already: answer now and deliver in the background, as the
+    # reconnect flush does, so a backlog cannot hold the ack past the
+    # phone's timeout (the phone would then send the photo again)
+    if session_id in active_sessions:
+        socketio.start_background_task(deliver_or_spool, session_id, meta, io.BytesIO(upload['spool']))
+        return {'status': 'relayed', 'upload_id': upload['upload_id'], 'timeout': SPOOL_TTL + DELIVERY_TIMEOUT}
+    if spool_upload(session_id, meta, upload['spool']):
+        return {
+            'status': 'relayed',
+            'upload_id': upload['upload_id'],
+            'timeout': SPOOL_TTL + DELIVERY_TIMEOUT,
+            'spooled': True
+        }
+    return upload_error('Desktop not connected. Please ensure the desktop app is running.')
+
+# Streamed uploads over plain HTTP: POST /upload/<session_id> with the photo as
+# the raw request body (Content-Type: image/...), or as the first file of a
+# multipart/form-data body with its size in ?size=. The body is relayed as it
+# is read, SPOOL_CHUNK_SIZE at a time, so an upload holds about one piece in
+# memory however large the photo is (a desktop that is away still needs the
+# whole photo spooled).
+@app.route('/upload/<session_id>', methods=['POST'])
+def http_upload(session_id):
+    """Relay a photo streamed in an HTTP request body to the desktop"""
+    upload_id = request.args.get('upload_id') or uuid.uuid4().hex
+    batch_id = request.args.get('batch_id')
+    sha256 = request.args.get('sha256')
+    
+    if not valid_id(upload_id) or (batch_id is not None and not valid_id(batch_id)):
+        return jsonify(upload_error('Invalid upload ID', 'invalid_id')), 400
+    if sha256 is not None and not SHA256_PATTERN.match(sha256):
+        return jsonify(upload_error('Invalid checksum', 'invalid_id')), 400
+    if upload_id in active_uploads:
+        return jsonify(upload_error('Upload already in progress', 'invalid_id')), 409
+    
+    # Validate session
+    state = desktop_state(session_id)
+    if state is None:
+        logger.warning(f"Invalid session or desktop not connected: {session_id}")
+        return jsonify(upload_error('Desktop not connected. Please ensure the desktop app is running.',
+                                    'desktop_not_connected')), 404
+    
+    # Bodies without a length (chunked transfer encoding) are not accepted
+    if request.content_length is None:
+        return jsonify(upload_error('Content-Length required', 'invalid_size')), 411
+    if request.content_length > app.config['MAX_CONTENT_LENGTH']:
+        return jsonify(upload_error('File too large (max 10MB)', 'too_large')), 413
+    
+    if request.mimetype == 'multipart/form-data':
+        total_size = request.args.get('size', type=int)
+        pieces = read_multipart_file(request.stream, request.mimetype_params.get('boundary', ''))
+        try:
+            headers = next(pieces, None)
+        except (ValueError, RequestEntityTooLarge, ClientDisconnected):
+            headers = None
+        if headers is None:
+            return jsonify(upload_error('No photo data received', 'no_data')), 400
+        mime_type = headers.get('Content-Type', '').split(';')[0].strip().lower()
+    else:
+        total_size = request.content_length
+        pieces = iter(functools.partial(request.stream.read, SPOOL_CHUNK_SIZE), b'')
+        mime_type = request.mimetype
+    
+    # Registered like chunked uploads, so a desktop leaving cancels it
+    upload, error, status = new_upload(upload_id, session_id, state, mime_type, total_size, sha256, batch_id)
+    if error:
+        return jsonify(error), status
+    try:
+        response, status = relay_stream(upload, pieces)
+    except (ClientDisconnected, OSError):
+        # The phone went away mid-body; it retries over Socket.IO
+        if upload['spool'] is None:
+            send_to_desktop(session_id, 'photo_abort', {'upload_id': upload_id})
+        logger.warning(f"HTTP upload {upload_id} interrupted after {upload['offset']} bytes")
+        return jsonify(upload_error('Upload interrupted')), 400
+    except (ValueError, RequestEntityTooLarge):
+        if upload['spool'] is None:
+            send_to_desktop(session_id, 'photo_abort', {'upload_id': upload_id})
+        return jsonify(upload_error('Invalid photo data', 'invalid_data')), 400
+    finally:
+        if active_uploads.get(upload_id) is upload:
+            active_uploads.pop(upload_id, None)
+    return jsonify(response), status
+
+def read_multipart_file(stream, boundary):
+    """Yield the headers of the first file in a multipart/form-data body, then its data.
+    
+    Form fields before the file are skipped and nothing after it is read.
+    Raises ValueError for a malformed or truncated body.
+    """
+    decoder = MultipartDecoder(boundary.encode('latin-1'), max_form_memory_size=MAX_CHUNK_SIZE)
+    in_file = False
+    while True:
+        event = decoder.next_event()
+        if isinstance(event, NeedData):
+            decoder.receive_data(stream.read(SPOOL_CHUNK_SIZE) or None)
+        elif isinstance(event, File) and not in_file:
+            in_file = True
+            yield event.headers
+        elif isinstance(event, Data) and in_file:
+            if event.data:
+                yield event.data
+            if not event.more_data:
+                return
+        elif isinstance(event, Epilogue):
+            return
+
+def relay_stream(upload, pieces):
+    """Relay an HTTP upload piece by piece as the body is read; returns (response, HTTP status).
+    
+    While the desktop's window is full the body is simply not read, so TCP
+    holds the phone back instead of the relay buffering for it.
+    """
+    upload_id = upload['upload_id']
+    session_id = upload['session_id']
+    desktop_sid = active_sessions.get(session_id)
+    
+    # The body must start like an image; nothing is relayed otherwise
+    head = b''
+    for piece in pieces:
+        head += piece
+        if len(head) >= SNIFF_LENGTH:
+            break
+    sniffed_type = sniff_image_type(head[:SNIFF_LENGTH])
+    if sniffed_type is None:
+        logger.warning(f"Upload {upload_id} is not an image (declared {upload['mime_type']})")
+        return upload_error(NOT_AN_IMAGE, 'not_an_image'), 415
+    upload['mime_type'] = sniffed_type
+    
+    if upload['spool'] is None:
+        send_to_desktop(session_id, 'photo_begin', {
+            'upload_id': upload_id,
+            'batch_id': upload['batch_id'],
+            'mime_type': sniffed_type,
+            'total_size': upload['total_size'],
+            'sha256': upload['sha256']
+        })
+    events.event('upload_started', session_id=session_id, upload_id=upload_id, size=upload['total_size'],
+                 transport='http', spooled=upload['spool'] is not None)
+    
+    for piece in itertools.chain([head], pieces):
+        if upload_lost(upload, desktop_sid):
+            return lost_upload_response(upload)
+        if upload['offset'] + len(piece) > upload['total_size']:
+            if upload['spool'] is None:
+                send_to_desktop(session_id, 'photo_abort', {'upload_id': upload_id})
+            return upload_error('Upload exceeds declared size', 'exceeds_size'), 400
+        
+        metrics.inc('relay_received_bytes_total', len(piece))
+        upload['hasher'].update(piece)
+        upload['active_at'] = time.monotonic()
+        if upload['spool'] is not None:
+            upload['spool'] += piece
+            upload['offset'] += len(piece)
+            continue
+        
+        # Desktop window full: stop reading until it catches up
+        ack_id = wait_for_window(session_id, len(piece))
+        if upload_lost(upload, desktop_sid):
+            return lost_upload_response(upload)
+        
+        send_to_desktop(session_id, 'photo_chunk', {
+            'upload_id': upload_id,
+            'seq': upload['next_seq'],
+            'offset': upload['offset'],
+            'data': piece,
+            'ack_id': ack_id
+        })
+        metrics.inc('relay_relayed_bytes_total', len(piece))
+        upload['offset'] += len(piece)
+        upload['next_seq'] += 1
+        
+        # The phone has no upload events to follow, so it hears progress too
+        progress = report_progress(upload, record_throughput(session_id, len(piece)))
+        if progress:
+            socketio.emit('upload_progress', progress, room=f"mobile_{session_id}")
+    
+    digest = upload['hasher'].hexdigest()
+    if upload['offset'] != upload['total_size']:
+        error = upload_error('Upload is shorter than its declared size', 'invalid_size')
+    elif upload['sha256'] and upload['sha256'].lower() != digest:
+        logger.warning(f"Checksum mismatch for upload {upload_id}")
+        error = upload_error('Checksum mismatch. Please try again.', 'checksum_mismatch')
+    else:
+        error = None
+    if error:
+        if upload['spool'] is None:
+            send_to_desktop(session_id, 'photo_abort', {'upload_id': upload_id})
+        return error, 400
+    
+    if upload_lost(upload, desktop_sid):
+        return lost_upload_response(upload)
+    if upload['spool'] is not None:
+        response = finish_spooled_upload(upload, digest)
+        return response, 503 if response['status'] == 'error' else 200
+    
+    return relay_finished_upload(upload, digest, 'http'), 200
+
+def upload_lost(upload, desktop_sid):
+    """Whether an HTTP upload was cancelled (its desktop left, or it expired) while being read"""
+    if active_uploads.get(upload['upload_id']) is not upload:
+        return True
+    return upload['spool'] is None and active_sessions.get(upload['session_id']) != desktop_sid
+
+def lost_upload_response(upload):
+    """Tell the phone to send a cancelled HTTP upload again (it is spooled then, if the desktop is away)"""
+    logger.warning(f"HTTP upload {upload['upload_id']} cancelled after {upload['offset']} bytes")
+    if upload['spool'] is None:
+        send_to_desktop(upload['session_id'], 'photo_abort', {'upload_id': upload['upload_id']})
+    return upload_error('Desktop disconnected before the photo was delivered', 'desktop_not_connected',
+                        retry=True), 503
+
 if __name__ == '__main__':
     port = int(os.getenv('PORT', 5000))
+    # FLASK_DEBUG=0 turns off the reloader and debugger (the desktop app's
+    # local relay mode does, since it listens on the LAN)
+    debug = os.getenv('FLASK_DEBUG', '1').lower() not in ('0', 'false', 'no')
     logger.info(f"Starting server on port {port}")
-    socketio.run(app, host='0.0.0.0', port=port, debug=True, allow_unsafe_werkzeug=True)
\ No newline at end of file
+    socketio.run(app, host='0.0.0.0', port=port, debug=debug, allow_unsafe_werkzeug=True)
\ No newline at end of file